@@ -4,10 +4,14 @@ import time
 import pytz
 from datetime import datetime, timedelta
 from utils.firebase_auth import sign_in, get_user_info
+from utils.embedding_registry import get_registry_stats
+from config.pipeline import SCRAPE_STREAMING, PDF_STREAMING
+from utils import bulk_ingest
 from application.user_service import UserService
 from application.user_index_service import UserIndexService
 from application.prompt_service import PromptService
 from application.performance_service import PerformanceService
+from application.document_catalog_service import DocumentCatalogService
 from utils.example_prompt import system_prompt_example, system_prompt_title_reccomend_example
 
 user_service = UserService()
@@ -15,6 +19,154 @@ user_index_service = UserIndexService()
 prompt_service = PromptService()
 env = st.secrets.get("ENV", "")
 
+def make_upsert_progress():
+    """ベクトルのアップロード進捗をプログレスバーに表示するコールバックを返す。"""
+    progress_bar = st.progress(0.0, text="アップロード中...")
+
+    def _callback(done, total):
+        progress_bar.progress(done / total if total else 1.0, text=f"アップロード中... {done}/{total}")
+
+    return _callback
+
+def show_registration_stats(embed_stats, upsert_stats):
+    st.success("データをPineconeに登録しました！")
+    st.caption(f"再利用したチャンク: {embed_stats['reused_chunks']} / {embed_stats['total_chunks']}")
+    if embed_stats.get('tokens_per_second'):
+        st.caption(f"埋め込み: {embed_stats['encoded_tokens']}トークン / {embed_stats['tokens_per_second']}トークン/秒")
+    st.caption(f"アップロード: {upsert_stats['upserted']}件 / {upsert_stats['vectors_per_second']}件/秒")
+    st.caption(f"削除: {upsert_stats['deleted']}件 / 変更なし: {upsert_stats['unchanged']}件")
+    if upsert_stats.get('extract_cache_hit'):
+        st.caption(f"PDF抽出: 抽出済みのテキストを再利用しました（{upsert_stats['pages']}ページ）")
+    elif upsert_stats.get('pages_per_second'):
+        st.caption(f"PDF抽出: {upsert_stats['pages']}ページ / {upsert_stats['pages_per_second']}ページ/秒")
+
+def register_url(index, catalog_service, url, namespace, force_refresh=False):
+    """URLをスクレイピングして登録し、カタログに記録する。"""
+    if SCRAPE_STREAMING:
+        register_url_streaming(index, catalog_service, url, namespace, force_refresh)
+        return
+    scraped_data = sh.scrape_url(url, force_refresh=force_refresh)
+    combined_text, metadata_list = sh.prepare_text_and_metadata(sh.extract_keys_from_json(scraped_data))
+    chunks = sh.split_text(combined_text)
+    embeddings, embed_stats = sh.make_chunks_embeddings(chunks, return_stats=True)
+    source_id = sh.make_source_id("url", metadata_list[0]['original_url'])
+    existing_ids = catalog_service.get_vector_ids(namespace, source_id)
+    upsert_stats = sh.store_data_in_pinecone(index, embeddings, chunks, metadata_list, namespace, progress_callback=make_upsert_progress(), existing_ids=existing_ids)
+    catalog_service.record_source(namespace, source_id, "url", metadata_list[0]['title'], upsert_stats['vector_ids'])
+    show_registration_stats(embed_stats, upsert_stats)
+
+def register_url_streaming(index, catalog_service, url, namespace, force_refresh=False):
+    """クロールの完了を待たずに、取得できたページから順に登録する。"""
+    progress_text = st.empty()
+    progress_text.write("クロールを開始しました...")
+
+    def _callback(pages, chunks):
+        progress_text.write(f"クロール中... {pages}ページ取得 / {chunks}チャンク登録済み")
+
+    stats = sh.ingest_url_streaming(
+        index, url, namespace,
+        get_existing_ids=lambda source_id: catalog_service.get_vector_ids(namespace, source_id),
+        force_refresh=force_refresh,
+        progress_callback=_callback,
+    )
+    progress_text.write(f"{stats['pages']}ページを取り込みました")
+    if stats['crawl_status'] != "SUCCEEDED":
+        st.warning(f"クロールが途中で終了しました（{stats['crawl_status']}）。取得できたページだけを追加し、登録済みのデータは残しています")
+    catalog_service.record_source(namespace, stats['source_id'], "url", stats['title'], stats['vector_ids'])
+    show_registration_stats(stats, stats)
+
+def register_pdf(index, catalog_service, pdf_file, namespace):
+    """PDFのテキストを抽出して登録し、カタログに記録する。"""
+    if PDF_STREAMING:
+        register_pdf_streaming(index, catalog_service, pdf_file, namespace)
+        return
+    pdf_text = sh.extract_text_from_pdf(pdf_file)
+    chunks = sh.split_text(pdf_text)
+    embeddings, embed_stats = sh.make_chunks_embeddings(chunks, return_stats=True)
+    source_id = sh.make_source_id("pdf", pdf_file.name)
+    existing_ids = catalog_service.get_vector_ids(namespace, source_id)
+    upsert_stats = sh.store_pdf_data_in_pinecone(index, embeddings, chunks, pdf_file.name, namespace, progress_callback=make_upsert_progress(), existing_ids=existing_ids)
+    catalog_service.record_source(namespace, source_id, "pdf", pdf_file.name, upsert_stats['vector_ids'])
+    show_registration_stats(embed_stats, upsert_stats)
+
+def register_pdf_streaming(index, catalog_service, pdf_file, namespace):
+    """PDF全体を読み込まずに、ページ単位で抽出しながら一定件数ずつ登録する。"""
+    source_id = sh.make_source_id("pdf", pdf_file.name)
+    progress_bar = st.progress(0.0, text="PDFを読み込んでいます...")
+
+    def _callback(pages, total_pages, chunks):
+        progress_bar.progress(pages / total_pages if total_pages else 1.0, text=f"{pages}/{total_pages}ページ / {chunks}チャンク登録済み")
+
+    stats = sh.ingest_pdf_streaming(
+        index, pdf_file, namespace,
+        existing_ids=catalog_service.get_vector_ids(namespace, source_id),
+        progress_callback=_callback,
+    )
+    catalog_service.record_source(namespace, source_id, "pdf", pdf_file.name, stats['vector_ids'])
+    show_registration_stats(stats, stats)
+
+def render_bulk_registration(index, catalog_service):
+    """URLの一覧・サイトマップ・複数のPDFをまとめて登録するフォーム。"""
+    namespace_labels = {"URL (ns2)": "ns2", "過去プロット (ns3)": "ns3", "競合データ (ns4)": "ns4", "その他PDF (ns5)": "ns5"}
+    namespace = namespace_labels[st.selectbox("登録先", list(namespace_labels.keys()), key="bulk_namespace")]
+    url_list = st.text_area("URLの一覧（1行に1つ）", key="bulk_urls")
+    sitemap_url = st.text_input("サイトマップのURL", key="bulk_sitemap")
+    pdf_files = st.file_uploader("PDFファイル（複数可）", type=["pdf"], accept_multiple_files=True, key="bulk_pdfs")
+
+    if not st.button("一括登録", key="bulk_register"):
+        return
+
+    urls = bulk_ingest.parse_url_list(url_list)
+    if sitemap_url:
+        try:
+            urls = bulk_ingest.dedupe_urls(urls + bulk_ingest.load_sitemap_urls(sitemap_url))
+        except Exception as e:
+            st.error(f"サイトマップを読み込めませんでした: {e}")
+            return
+    documents = [bulk_ingest.url_document(url) for url in urls] + [bulk_ingest.pdf_document(pdf_file) for pdf_file in pdf_files or []]
+    if not documents:
+        st.info("登録するURLまたはPDFを指定してください")
+        return
+
+    progress_bar = st.progress(0.0, text=f"0/{len(documents)}件")
+    latest = st.empty()
+
+    def _callback(done, total, result):
+        progress_bar.progress(done / total, text=f"{done}/{total}件")
+        latest.write(f"{'✅' if result['status'] == 'success' else '❌'} {result['source']} {result['message']}")
+
+    results = bulk_ingest.run_bulk_ingestion(index, documents, namespace, catalog_service=catalog_service, progress_callback=_callback)
+    failed = [result for result in results if result['status'] != 'success']
+    if failed:
+        st.warning(f"{len(results) - len(failed)}件を登録しました（{len(failed)}件失敗）")
+    else:
+        st.success(f"{len(results)}件を登録しました！")
+    st.dataframe(results)
+
+def render_registered_sources(index, catalog_service, namespace):
+    """登録済みのURL・PDFの一覧を表示し、選択したものだけを削除できるようにする。"""
+    # 再実行のたびにカタログを読み込まないよう、表示を選んだときだけ一覧を取得する
+    if not st.checkbox("登録済みデータを表示", key=f"show_sources_{namespace}"):
+        return
+    with st.container(border=True):
+        sources = catalog_service.list_sources(namespace)
+        if not sources:
+            st.write("登録済みのデータはありません")
+            return
+
+        labels = {f"{source['title'] or source['source_id']} ({source.get('chunk_count', '?')}チャンク)": source for source in sources}
+        selected_label = st.selectbox("データを選択", list(labels.keys()), key=f"source_select_{namespace}")
+        selected_source = labels[selected_label]
+        st.caption(f"ID: {selected_source['source_id']}")
+        st.caption(f"更新日時: {selected_source['updated_at']}")
+
+        if st.button("選択したデータを削除", key=f"delete_source_{namespace}"):
+            result = catalog_service.delete_source(sh.as_vector_store(index), namespace, selected_source['source_id'])
+            if result['status'] == 'success':
+                st.success(f"{result['deleted']}件のデータが削除されました！")
+            else:
+                st.error("データの削除に失敗しました")
+
 def main():
     st.set_page_config(
         page_icon='🤖',
@@ -157,16 +309,25 @@ def main():
     if 'user_info' in st.session_state:
         if env == "develop":
             st.sidebar.write(f"User ID: {st.session_state['user_info']['email']}")
+            st.sidebar.write("埋め込みモデル:", get_registry_stats())
+            st.sidebar.write("クエリ埋め込みキャッシュ:", sh.query_embedding_cache.stats())
 
     if 'user_index' in st.session_state and st.session_state['user_index']:
         if env == "develop":
             st.sidebar.write(f"Index Name: {st.session_state['user_index']['index_name']}")
             st.sidebar.write(f"Langsmith Project Name: {st.session_state['user_index']['langsmith_project_name']}")
+            st.sidebar.write("Pinecone接続プール:", sh.pinecone_pool.stats())
+            if sh.scrape_cache is not None:
+                st.sidebar.write("スクレイピングキャッシュ:", sh.scrape_cache.stats())
+            if sh.pdf_text_cache is not None:
+                st.sidebar.write("PDFテキストキャッシュ:", sh.pdf_text_cache.stats())
+            if sh.retrieval_cache is not None:
+                st.sidebar.write("検索結果キャッシュ:", sh.retrieval_cache.stats())
         index_name = st.session_state['user_index']['index_name']
         pinecone_api_key = st.session_state['user_index']['pinecone_api_key']
         langsmith_project_name = st.session_state['user_index']['langsmith_project_name']
         try:
-            index = sh.initialize_pinecone(index_name, pinecone_api_key)
+            index = sh.initialize_vector_store(index_name, pinecone_api_key)
         except Exception as e:
             st.sidebar.write("インデックスの初期化に失敗しました")
             st.sidebar.write("エラーメッセージ: ", e)
@@ -207,20 +368,26 @@ def main():
                     st.info("このURLは読み込めません。お手数をおかけしますが別のURLをお試し下さい。")
                     st.stop()
                 else:
-                    if 'last_url' not in st.session_state or (st.session_state['last_url'] != url or url == ""):
+                    # 計測用パラメータや末尾のスラッシュだけが違うURLは同じURLとして扱う
+                    url_key = sh.canonicalize_url(url) if url else ""
+                    if 'last_url' not in st.session_state or (st.session_state['last_url'] != url_key or url == ""):
                         try:
                             sh.delete_all_data_in_namespace(index, "ns1")
                         except Exception:
                             pass
 
-                        st.session_state['last_url'] = url
+                        st.session_state['last_url'] = url_key
                         if url != "":
                             scraped_data = sh.scrape_url(url)
                             combined_text, metadata_list = sh.prepare_text_and_metadata(sh.extract_keys_from_json(scraped_data))
                             chunks = sh.split_text(combined_text)
                             embeddings = sh.make_chunks_embeddings(chunks)
-                            sh.store_data_in_pinecone(index, embeddings, chunks, metadata_list, "ns1")
-                            time.sleep(10)
+                            # ns1は直前に空にしているため、保存済みのIDは無い
+                            upsert_stats = sh.store_data_in_pinecone(index, embeddings, chunks, metadata_list, "ns1", existing_ids=[])
+                            # 書き込んだベクトルが検索に反映されるまで待つ
+                            readiness = sh.wait_for_vectors_ready(index, "ns1", expected_count=len(upsert_stats['vector_ids']), probe_ids=upsert_stats['vector_ids'][-1:])
+                            if env == "develop":
+                                st.caption(f"インデックス反映待ち: {readiness['waited_seconds']}秒")
                             st.success("ウェブサイトを読み込みました！")
                     else:
                         st.info("同じウェブサイトのデータを使用")
@@ -247,81 +414,81 @@ def main():
 
     with tab2:
         st.header('データを登録')
+        catalog_service = DocumentCatalogService(index_name, index.tenant)
         col1, col2, col3, col4 = st.columns(4)
 
         with col1:
             st.subheader("URLの登録")
             url = st.text_input("登録URLを入力してください")
+            force_refresh = st.checkbox("キャッシュを使わずに再取得", key="force_refresh_ns2")
             register_button1 = st.button("URL登録")
 
             if register_button1:
-                scraped_data = sh.scrape_url(url)
-                combined_text, metadata_list = sh.prepare_text_and_metadata(sh.extract_keys_from_json(scraped_data))
-                chunks = sh.split_text(combined_text)
-                embeddings = sh.make_chunks_embeddings(chunks)
-                sh.store_data_in_pinecone(index, embeddings, chunks, metadata_list, "ns2")
-                st.success("データをPineconeに登録しました！")
+                register_url(index, catalog_service, url, "ns2", force_refresh=force_refresh)
 
             delete_all_button1 = st.button("URL全データ削除")
 
             if delete_all_button1:
                 sh.delete_all_data_in_namespace(index, "ns2")
+                catalog_service.clear_namespace("ns2")
                 st.success("全データが削除されました！")
 
+            render_registered_sources(index, catalog_service, "ns2")
+
         with col2:
             st.subheader("過去プロットの登録")
             pdf_file1 = st.file_uploader("PDFファイルをアップロード", type=["pdf"], key="pdf_file1")
             register_button2 = st.button("PDF登録")
 
             if register_button2 and pdf_file1 is not None:
-                pdf_text = sh.extract_text_from_pdf(pdf_file1)
-                chunks = sh.split_text(pdf_text)
-                embeddings = sh.make_chunks_embeddings(chunks)
-                sh.store_pdf_data_in_pinecone(index, embeddings, chunks, pdf_file1.name, "ns3")
-                st.success("データをPineconeに登録しました！")
+                register_pdf(index, catalog_service, pdf_file1, "ns3")
 
             delete_all_button2 = st.button("全データ削除")
 
             if delete_all_button2:
                 sh.delete_all_data_in_namespace(index, "ns3")
+                catalog_service.clear_namespace("ns3")
                 st.success("全データが削除されました！")
 
+            render_registered_sources(index, catalog_service, "ns3")
+
         with col3:
             st.subheader("競合データの登録")
             pdf_file2 = st.file_uploader("PDFファイルをアップロード", type=["pdf"], key="pdf_file2")
             register_button3 = st.button("PDF登録", key="register_button3")
 
             if register_button3 and pdf_file2 is not None:
-                pdf_text = sh.extract_text_from_pdf(pdf_file2)
-                chunks = sh.split_text(pdf_text)
-                embeddings = sh.make_chunks_embeddings(chunks)
-                sh.store_pdf_data_in_pinecone(index, embeddings, chunks, pdf_file2.name, "ns4")
-                st.success("データをPineconeに登録しました！")
+                register_pdf(index, catalog_service, pdf_file2, "ns4")
 
             delete_all_button3 = st.button("全データ削除", key="delete_all_3")
 
             if delete_all_button3:
                 sh.delete_all_data_in_namespace(index, "ns4")
+                catalog_service.clear_namespace("ns4")
                 st.success("全データが削除されました！")
 
+            render_registered_sources(index, catalog_service, "ns4")
+
         with col4:
             st.subheader("その他PDFの登録")
             pdf_file3 = st.file_uploader("PDFをアップロード", type=["pdf"], key="pdf_file3")
             register_button4 = st.button("PDF登録", key="register_button4")
 
             if register_button4 and pdf_file3 is not None:
-                pdf_text = sh.extract_text_from_pdf(pdf_file3)
-                chunks = sh.split_text(pdf_text)
-                embeddings = sh.make_chunks_embeddings(chunks)
-                sh.store_pdf_data_in_pinecone(index, embeddings, chunks, pdf_file3.name, "ns5")
-                st.success("データをPineconeに登録しました！")
+                register_pdf(index, catalog_service, pdf_file3, "ns5")
 
             delete_all_button4 = st.button("全データ削除", key="delete_all_4")
 
             if delete_all_button4:
                 sh.delete_all_data_in_namespace(index, "ns5")
+                catalog_service.clear_namespace("ns5")
                 st.success("全データが削除されました！")
 
+            render_registered_sources(index, catalog_service, "ns5")
+
+        with st.expander("一括登録"):
+            render_bulk_registration(index, catalog_service)
+
     with tab3:
         st.header("投稿テーマ提案")
         
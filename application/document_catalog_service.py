@@ -0,0 +1,54 @@
+from infrastructure.document_catalog_repository import DocumentCatalogRepository
+from domain.document_source import DocumentSource
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+
+class DocumentCatalogService:
+    """登録したURL・PDFごとに、保存先のネームスペースとベクトルIDを管理する。"""
+
+    def __init__(self, index_name: str, tenant: str):
+        self.index_name = index_name
+        self.tenant = tenant
+        self.catalog_repo = DocumentCatalogRepository()
+
+    def record_source(self, namespace: str, source_id: str, source_type: str, title: str, vector_ids: List[str]) -> Dict[str, Any]:
+        source = DocumentSource(
+            source_id=source_id,
+            index_name=self.index_name,
+            tenant=self.tenant,
+            namespace=namespace,
+            source_type=source_type,
+            title=title or '',
+            vector_ids=vector_ids,
+            chunk_count=len(vector_ids),
+            updated_at=datetime.now()
+        )
+        return self.catalog_repo.save_source(source)
+
+    def inspect_source(self, namespace: str, source_id: str) -> Dict[str, Any]:
+        return self.catalog_repo.read_source(self.tenant, self.index_name, namespace, source_id)
+
+    def list_sources(self, namespace: str) -> List[Dict[str, Any]]:
+        """登録済みのソースの概要（vector_idsを除く）を新しい順に返す。"""
+        sources = self.catalog_repo.list_sources(self.tenant, self.index_name, namespace)['data']
+        return sorted(sources, key=lambda source: source['updated_at'], reverse=True)
+
+    def get_vector_ids(self, namespace: str, source_id: str) -> Optional[List[str]]:
+        """登録済みのソースのベクトルIDを返す。未登録の場合はNoneを返す。"""
+        source = self.inspect_source(namespace, source_id)
+        if source['status'] == 'success':
+            return source['data'].get('vector_ids', [])
+        return None
+
+    def delete_source(self, store, namespace: str, source_id: str) -> Dict[str, Any]:
+        """ソースのベクトルをIDでまとめて削除し、カタログからも削除する。"""
+        vector_ids = self.get_vector_ids(namespace, source_id)
+        if vector_ids is None:
+            return {'status': 'error', 'message': 'Document not found'}
+        store.delete(vector_ids, namespace)
+        self.catalog_repo.delete_source(self.tenant, self.index_name, namespace, source_id)
+        return {'status': 'success', 'deleted': len(vector_ids)}
+
+    def clear_namespace(self, namespace: str) -> Dict[str, Any]:
+        return self.catalog_repo.delete_namespace(self.tenant, self.index_name, namespace)
@@ -0,0 +1,43 @@
+"""
+埋め込みバックエンドの精度とスループットを比較するスクリプト。
+
+使い方:
+    python -m benchmarks.compare_embedding_backends 競合データ.pdf [その他.pdf ...]
+
+実際のPDFを本番と同じ設定(1000文字/重複100文字)でチャンク化し、
+現行のフル精度ベクトルを基準に各バックエンドのコサイン類似度・近傍一致率・件数/秒を表示する。
+"""
+import argparse
+import json
+from PyPDF2 import PdfReader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from utils.embedding_backend import BACKENDS, compare_backends
+from utils.embedding_registry import get_rss_mb
+
+
+def load_chunks(pdf_paths):
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+    chunks = []
+    for path in pdf_paths:
+        text = "\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+        chunks.extend(splitter.split_text(text))
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf_paths", nargs="+")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--reference", default="torch", choices=list(BACKENDS))
+    parser.add_argument("--candidates", nargs="+", default=["torch-int8"], choices=list(BACKENDS))
+    args = parser.parse_args()
+
+    chunks = load_chunks(args.pdf_paths)
+    print(f"チャンク数: {len(chunks)}")
+    results = compare_backends(chunks, args.model, reference=args.reference, candidates=args.candidates)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    print(f"RSS: {get_rss_mb():.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
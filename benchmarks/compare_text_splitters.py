@@ -0,0 +1,66 @@
+"""
+テキスト分割器のスループットとチャンクの形を比較するスクリプト。
+
+使い方:
+    python -m benchmarks.compare_text_splitters 競合データ.pdf [その他.pdf ...]
+
+実際のPDFのテキストを本番と同じ設定(1000文字/重複100文字)で各分割器に通し、
+1秒あたりの文字数・チャンク数・チャンク長の分布を表示する。
+"""
+import argparse
+import json
+import statistics
+import time
+from PyPDF2 import PdfReader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from utils.text_splitter import JapaneseTextSplitter
+
+SPLITTERS = {
+    "langchain": RecursiveCharacterTextSplitter,
+    "japanese": JapaneseTextSplitter,
+}
+
+
+def load_text(pdf_paths):
+    texts = []
+    for path in pdf_paths:
+        texts.append("".join((page.extract_text() or "") + "\n" for page in PdfReader(path).pages))
+    return "".join(texts)
+
+
+def benchmark(splitter, text, repeat):
+    # 初回はウォームアップとして計測しない
+    chunks = splitter.split_text(text)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        splitter.split_text(text)
+    elapsed = (time.perf_counter() - started) / repeat
+    lengths = [len(chunk) for chunk in chunks]
+    return {
+        "seconds": round(elapsed, 4),
+        "chars_per_second": round(len(text) / elapsed) if elapsed else None,
+        "chunks": len(chunks),
+        "max_chunk_chars": max(lengths, default=0),
+        "mean_chunk_chars": round(statistics.mean(lengths), 1) if lengths else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf_paths", nargs="+")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    text = load_text(args.pdf_paths)
+    print(f"文字数: {len(text)}")
+    results = {
+        name: benchmark(splitter_class(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap), text, args.repeat)
+        for name, splitter_class in SPLITTERS.items()
+    }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import streamlit as st
+
+# 埋め込みモデルの設定
+EMBEDDING_MODEL_NAME = st.secrets.get("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+# 埋め込みバックエンド（"torch": フル精度 / "torch-int8": int8動的量子化）
+EMBEDDING_BACKEND = st.secrets.get("EMBEDDING_BACKEND", "torch")
+# サーバー起動時にバックグラウンドでモデルをロードしておくか
+EMBEDDING_WARMUP = st.secrets.get("EMBEDDING_WARMUP", True)
+
+# クエリ埋め込みキャッシュの設定
+QUERY_EMBEDDING_CACHE_SIZE = int(st.secrets.get("QUERY_EMBEDDING_CACHE_SIZE", 1024))
+# 空文字の場合はディスクキャッシュを使わない
+QUERY_EMBEDDING_CACHE_PATH = st.secrets.get("QUERY_EMBEDDING_CACHE_PATH", "")
+
+# チャンク埋め込みストアの設定（空文字の場合は使わない）
+CHUNK_EMBEDDING_STORE_PATH = st.secrets.get("CHUNK_EMBEDDING_STORE_PATH", ".cache/chunk_embeddings.sqlite3")
+# ディスク上の保存形式（float16 または float32）
+CHUNK_EMBEDDING_STORE_DTYPE = st.secrets.get("CHUNK_EMBEDDING_STORE_DTYPE", "float16")
+CHUNK_EMBEDDING_STORE_MAX_ENTRIES = int(st.secrets.get("CHUNK_EMBEDDING_STORE_MAX_ENTRIES", 200000))
+
+# マルチプロセス埋め込みプールの設定（0の場合は使わない）
+EMBEDDING_POOL_WORKERS = int(st.secrets.get("EMBEDDING_POOL_WORKERS", 0))
+# 1ワーカーに一度に渡すチャンク数
+EMBEDDING_POOL_SHARD_SIZE = int(st.secrets.get("EMBEDDING_POOL_SHARD_SIZE", 64))
+# これより少ないチャンク数の場合はプールを使わずにその場でエンコードする
+EMBEDDING_POOL_MIN_CHUNKS = int(st.secrets.get("EMBEDDING_POOL_MIN_CHUNKS", 256))
+
+# チャンク埋め込みのバッチ分けの設定
+# チャンクをトークン数の近いもの同士でバッチにまとめ、短いチャンクのパディングを減らすか
+EMBEDDING_BUCKETING = st.secrets.get("EMBEDDING_BUCKETING", True)
+# 1バッチのトークン数（パディングを含む）の上限（0の場合はコア数と利用可能メモリから決める）
+EMBEDDING_BATCH_TOKEN_BUDGET = int(st.secrets.get("EMBEDDING_BATCH_TOKEN_BUDGET", 0))
+
+# 複数ネームスペース検索の設定
+# 各ネームスペースの検索を待つ最大秒数（超えた場合は「情報なし」として扱う）
+NAMESPACE_QUERY_TIMEOUT = float(st.secrets.get("NAMESPACE_QUERY_TIMEOUT", 10))
+NAMESPACE_QUERY_WORKERS = int(st.secrets.get("NAMESPACE_QUERY_WORKERS", 16))
+
+# ベクトルDBの設定（"pinecone" または プロセス内の "numpy"）
+VECTOR_STORE_BACKEND = st.secrets.get("VECTOR_STORE_BACKEND", "pinecone")
+# numpyバックエンドのデータを保存するディレクトリ（空文字の場合はメモリ上のみ）
+VECTOR_STORE_NUMPY_DIR = st.secrets.get("VECTOR_STORE_NUMPY_DIR", ".cache/vector_store")
+
+# ベクトルのアップロード設定
+# Pineconeの1リクエストの上限(2MB・1000件)に余裕を持たせた値
+UPSERT_BATCH_MAX_VECTORS = int(st.secrets.get("UPSERT_BATCH_MAX_VECTORS", 100))
+UPSERT_BATCH_MAX_BYTES = int(st.secrets.get("UPSERT_BATCH_MAX_BYTES", 1_500_000))
+UPSERT_MAX_WORKERS = int(st.secrets.get("UPSERT_MAX_WORKERS", 4))
+UPSERT_MAX_RETRIES = int(st.secrets.get("UPSERT_MAX_RETRIES", 4))
+
+# Pineconeクライアントプールの設定（この秒数使われなかった接続は破棄する）
+PINECONE_POOL_IDLE_SECONDS = int(st.secrets.get("PINECONE_POOL_IDLE_SECONDS", 1800))
+
+# チャンク本文などの大きなメタデータをインデックスに載せず、ローカルのストアに保存するか
+SLIM_VECTOR_METADATA = st.secrets.get("SLIM_VECTOR_METADATA", False)
+CHUNK_TEXT_STORE_PATH = st.secrets.get("CHUNK_TEXT_STORE_PATH", ".cache/chunk_texts.sqlite3")
+
+# 検索結果キャッシュの設定（0件の場合は使わない）
+RETRIEVAL_CACHE_SIZE = int(st.secrets.get("RETRIEVAL_CACHE_SIZE", 2048))
+# 他のプロセスからの書き込みに備えた有効期限（秒）
+RETRIEVAL_CACHE_TTL_SECONDS = int(st.secrets.get("RETRIEVAL_CACHE_TTL_SECONDS", 600))
+
+# 生成プロンプトに入れる検索結果の設定
+# 全ネームスペース合計のトークン数の上限（0の場合は従来どおり全件をそのまま入れる）
+CONTEXT_TOKEN_BUDGET = int(st.secrets.get("CONTEXT_TOKEN_BUDGET", 6000))
+# ネームスペースごとの予算配分の重み
+CONTEXT_NAMESPACE_WEIGHTS = dict(st.secrets.get("CONTEXT_NAMESPACE_WEIGHTS", {"ns1": 2.0, "ns2": 1.0, "ns3": 2.0, "ns4": 1.0, "ns5": 0.5}))
+
+# スクレイピング結果のキャッシュ設定（空文字の場合は使わない）
+SCRAPE_CACHE_DIR = st.secrets.get("SCRAPE_CACHE_DIR", ".cache/scrape")
+SCRAPE_CACHE_TTL_SECONDS = int(st.secrets.get("SCRAPE_CACHE_TTL_SECONDS", 3 * 24 * 60 * 60))
+SCRAPE_CACHE_MAX_BYTES = int(st.secrets.get("SCRAPE_CACHE_MAX_BYTES", 500 * 1024 * 1024))
+
+# スクレイピング結果を逐次取り込む設定
+# データ登録タブで、クロールの完了を待たずに取得できたページから順に登録するか
+SCRAPE_STREAMING = st.secrets.get("SCRAPE_STREAMING", True)
+SCRAPE_STREAM_PAGE_SIZE = int(st.secrets.get("SCRAPE_STREAM_PAGE_SIZE", 5))
+SCRAPE_POLL_INTERVAL_SECONDS = float(st.secrets.get("SCRAPE_POLL_INTERVAL_SECONDS", 2.0))
+
+# 書き込んだベクトルが検索できるようになるまで待つ最大秒数
+READINESS_MAX_WAIT_SECONDS = float(st.secrets.get("READINESS_MAX_WAIT_SECONDS", 10))
+
+# Apifyを使う前に、HTTPで直接取得して本文を抽出する高速経路の設定
+HTTP_FAST_PATH = st.secrets.get("HTTP_FAST_PATH", True)
+HTTP_FAST_PATH_TIMEOUT_SECONDS = float(st.secrets.get("HTTP_FAST_PATH_TIMEOUT_SECONDS", 3))
+# これより本文が短い場合はJavaScriptで描画されるページとみなしてApifyを使う
+HTTP_FAST_PATH_MIN_TEXT_CHARS = int(st.secrets.get("HTTP_FAST_PATH_MIN_TEXT_CHARS", 200))
+
+# 一括登録の設定
+BULK_EXTRACT_WORKERS = int(st.secrets.get("BULK_EXTRACT_WORKERS", 4))
+BULK_UPSERT_WORKERS = int(st.secrets.get("BULK_UPSERT_WORKERS", 2))
+# 段階の間で待たせておけるドキュメント数（メモリ使用量の上限になる）
+BULK_QUEUE_SIZE = int(st.secrets.get("BULK_QUEUE_SIZE", 4))
+BULK_SITEMAP_MAX_URLS = int(st.secrets.get("BULK_SITEMAP_MAX_URLS", 500))
+
+# URLの正規化・NG URLの設定
+# 登録・スクレイピングの前にリダイレクト先を解決するか
+URL_RESOLVE_REDIRECTS = st.secrets.get("URL_RESOLVE_REDIRECTS", True)
+# NG URLの一覧を読み込み直す間隔（秒）。ng_url_list.py に加え、secretsの NG_URL_PATTERNS も読み込む
+NG_URL_RELOAD_SECONDS = float(st.secrets.get("NG_URL_RELOAD_SECONDS", 30))
+
+# PDFを逐次取り込む設定
+# データ登録タブで、PDF全体を読み込まずにページ単位で抽出・埋め込み・アップロードするか
+PDF_STREAMING = st.secrets.get("PDF_STREAMING", True)
+# 一度に埋め込み・アップロードするチャンク数（メモリ使用量の上限になる）
+PDF_STREAM_BATCH_SIZE = int(st.secrets.get("PDF_STREAM_BATCH_SIZE", 64))
+
+# PDFのテキスト抽出をワーカープロセスで並列に行う設定（0の場合は使わない）
+PDF_EXTRACT_WORKERS = int(st.secrets.get("PDF_EXTRACT_WORKERS", 0))
+# 1ワーカーに一度に渡すページ数
+PDF_EXTRACT_PAGES_PER_TASK = int(st.secrets.get("PDF_EXTRACT_PAGES_PER_TASK", 8))
+# 1ページの抽出を待つ最大秒数（超えたページは空として扱う）
+PDF_EXTRACT_PAGE_TIMEOUT_SECONDS = float(st.secrets.get("PDF_EXTRACT_PAGE_TIMEOUT_SECONDS", 20))
+# これより少ないページ数の場合はプールを使わずにその場で抽出する
+PDF_EXTRACT_MIN_PAGES = int(st.secrets.get("PDF_EXTRACT_MIN_PAGES", 16))
+
+# PDFから抽出したテキストのキャッシュ設定（ファイルの中身のハッシュをキーにする。空文字の場合は使わない）
+PDF_TEXT_CACHE_DIR = st.secrets.get("PDF_TEXT_CACHE_DIR", ".cache/pdf_text")
+PDF_TEXT_CACHE_MAX_BYTES = int(st.secrets.get("PDF_TEXT_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+
+# テキスト分割の設定（"langchain": RecursiveCharacterTextSplitter / "japanese": 句点・改行で区切る日本語向けの分割）
+# 分割方法を変えるとチャンクのIDが変わり、登録済みのソースは次回の登録時に全チャンクが入れ替わる
+TEXT_SPLITTER = st.secrets.get("TEXT_SPLITTER", "langchain")
@@ -0,0 +1,28 @@
+from typing import List
+from datetime import datetime
+from pydantic import BaseModel, Field, validator
+
+
+class DocumentSource(BaseModel):
+    source_id: str = Field(..., min_length=1, max_length=2000)
+    index_name: str = Field(..., min_length=1, max_length=100)
+    # PineconeのAPIキーのハッシュ。同じインデックス名でもAPIキーが違えば別のカタログになる
+    tenant: str = Field('', max_length=100)
+    namespace: str = Field(..., min_length=1, max_length=50)
+    source_type: str = Field(..., min_length=1, max_length=50)
+    title: str = Field('', max_length=1000)
+    vector_ids: List[str] = Field(default_factory=list)
+    # 一覧表示でvector_idsを読み込まずに済むよう、チャンク数も保存する
+    chunk_count: int = 0
+    updated_at: datetime
+
+    @validator('source_type')
+    def validate_source_type(cls, v):
+        allowed_types = ['url', 'pdf']
+        if v not in allowed_types:
+            raise ValueError(f'Source type must be one of {allowed_types}')
+        return v
+
+    class Config:
+        anystr_strip_whitespace = True
+        validate_assignment = True
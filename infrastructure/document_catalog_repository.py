@@ -0,0 +1,48 @@
+import hashlib
+from domain.document_source import DocumentSource
+from typing import Dict, Any
+from config.firebase import db
+
+# 一覧表示に使う項目（vector_idsは件数が多いため読み込まない）
+SOURCE_SUMMARY_FIELDS = ['source_id', 'source_type', 'title', 'chunk_count', 'updated_at']
+
+class DocumentCatalogRepository:
+    def _collection(self, tenant: str, index_name: str, namespace: str):
+        # 同じインデックス名を使う別のAPIキーのカタログと混ざらないよう、テナントごとに分ける
+        return db.collection('document_catalog').document(f"{tenant}_{index_name}").collection(namespace)
+
+    def _document_id(self, source_id: str) -> str:
+        # URLには「/」が含まれドキュメントIDに使えないため、ハッシュ値を使う
+        return hashlib.sha256(source_id.encode('utf-8')).hexdigest()
+
+    def save_source(self, source: DocumentSource) -> Dict[str, Any]:
+        doc_ref = self._collection(source.tenant, source.index_name, source.namespace).document(self._document_id(source.source_id))
+        doc_ref.set(source.dict())
+        return {'status': 'success', 'source_id': source.source_id}
+
+    def read_source(self, tenant: str, index_name: str, namespace: str, source_id: str) -> Dict[str, Any]:
+        doc = self._collection(tenant, index_name, namespace).document(self._document_id(source_id)).get()
+        if doc.exists:
+            return {'status': 'success', 'data': doc.to_dict()}
+        else:
+            return {'status': 'error', 'message': 'Document not found'}
+
+    def delete_source(self, tenant: str, index_name: str, namespace: str, source_id: str) -> Dict[str, Any]:
+        doc_ref = self._collection(tenant, index_name, namespace).document(self._document_id(source_id))
+        doc = doc_ref.get()
+        if doc.exists:
+            doc_ref.delete()
+            return {'status': 'success'}
+        else:
+            return {'status': 'error', 'message': 'Document not found'}
+
+    def list_sources(self, tenant: str, index_name: str, namespace: str) -> Dict[str, Any]:
+        docs = self._collection(tenant, index_name, namespace).select(SOURCE_SUMMARY_FIELDS).stream()
+        return {'status': 'success', 'data': [doc.to_dict() for doc in docs]}
+
+    def delete_namespace(self, tenant: str, index_name: str, namespace: str) -> Dict[str, Any]:
+        deleted = 0
+        for doc in self._collection(tenant, index_name, namespace).stream():
+            doc.reference.delete()
+            deleted += 1
+        return {'status': 'success', 'deleted': deleted}
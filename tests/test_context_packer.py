@@ -0,0 +1,72 @@
+from utils.context_packer import count_tokens, dedupe_chunks, format_matches, pack_context, truncate_to_tokens
+
+
+def test_truncate_to_tokens_fits_budget():
+    text = "あいうえお" * 100
+    truncated = truncate_to_tokens(text, 10)
+    assert count_tokens(truncated) <= 10
+    assert text.startswith(truncated)
+    assert truncate_to_tokens(text, 0) == ""
+    assert truncate_to_tokens("short", 100) == "short"
+
+
+def test_dedupe_drops_contained_chunks_after_normalization():
+    kept = []
+    first = "ＡＢＣ　の説明です。\n次の段落です。"
+    results = dedupe_chunks([first, "ABC の説明です。"], kept)
+    assert results == [first, None]
+
+
+def test_dedupe_keeps_paragraph_breaks():
+    kept = []
+    chunk = "一つ目の段落です。\n\n二つ目の段落です。"
+    assert dedupe_chunks([chunk], kept) == [chunk]
+
+
+def test_dedupe_trims_split_overlap():
+    overlap = "ここは前後のチャンクで重なっている部分の文章です。" * 2
+    first = "前のチャンクの本文です。\n" + overlap
+    second = overlap + "\n後ろのチャンクの本文です。"
+    kept = []
+    assert dedupe_chunks([first, second], kept) == [first, "\n後ろのチャンクの本文です。"]
+
+
+def test_format_matches_omits_repeated_metadata_and_dropped_keys():
+    seen_values = set()
+    kept = []
+    metadata_list = [
+        {"title": "記事", "keywords": ["a"], "source_id": "url:x", "text_chunk": "本文1"},
+        {"title": "記事", "text_chunk": "本文2"},
+    ]
+    blocks = format_matches(metadata_list, seen_values, kept)
+    assert blocks == ["title: 記事\ntext_chunk: 本文1", "text_chunk: 本文2"]
+
+
+def test_pack_context_stays_within_budget():
+    matches_by_ns = {
+        ns: [{"text_chunk": f"{ns}の本文です。" * 200}]
+        for ns in ("ns1", "ns2", "ns3")
+    }
+    packed = pack_context(matches_by_ns, 300, {"ns1": 2.0})
+    assert sum(count_tokens(text) for text in packed.values()) <= 300
+    assert count_tokens(packed["ns1"]) > count_tokens(packed["ns2"])
+
+
+def test_pack_context_redistributes_unused_budget():
+    matches_by_ns = {
+        "ns1": [{"text_chunk": "短い本文"}],
+        "ns2": [{"text_chunk": "長い本文です。" * 500}],
+    }
+    packed = pack_context(matches_by_ns, 400)
+    assert packed["ns1"] == "text_chunk: 短い本文"
+    assert count_tokens(packed["ns2"]) > 200
+
+
+def test_pack_context_drops_namespaces_with_non_positive_weight():
+    matches_by_ns = {
+        "ns1": [{"text_chunk": "本文1"}],
+        "ns2": [{"text_chunk": "本文2"}],
+        "ns3": [{"text_chunk": "本文3"}],
+    }
+    packed = pack_context(matches_by_ns, 100, {"ns2": 0, "ns3": -1.0})
+    assert list(packed) == ["ns1"]
@@ -0,0 +1,28 @@
+from utils.disk_cache import CompressedDiskCache
+
+
+def test_list_writer_is_readable_after_commit(tmp_path):
+    cache = CompressedDiskCache(str(tmp_path))
+    writer = cache.list_writer("pdf-text:abc")
+    writer.append("1ページ目\n")
+    assert cache.get("pdf-text:abc") is None
+
+    writer.append('"引用"\n')
+    writer.commit()
+    assert cache.get("pdf-text:abc") == ["1ページ目\n", '"引用"\n']
+
+
+def test_list_writer_abort_leaves_nothing(tmp_path):
+    cache = CompressedDiskCache(str(tmp_path))
+    writer = cache.list_writer("pdf-text:abc")
+    writer.append("途中まで")
+    writer.abort()
+
+    assert cache.get("pdf-text:abc") is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_empty_list(tmp_path):
+    cache = CompressedDiskCache(str(tmp_path))
+    cache.list_writer("empty").commit()
+    assert cache.get("empty") == []
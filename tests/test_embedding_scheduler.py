@@ -0,0 +1,110 @@
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from utils import embedding_pool, embedding_registry
+from utils.embedding_backend import EmbeddingBackend
+from utils.embedding_scheduler import _MIN_TOKEN_BUDGET, default_token_budget, encode_bucketed, plan_batches
+
+
+class FakeBackend(EmbeddingBackend):
+    """トークン数を文字数とし、文字数と先頭の文字コードを埋め込みにするバックエンド"""
+
+    name = "fake"
+
+    def __init__(self):
+        super().__init__("fake-model")
+        self.batch_sizes = []
+
+    def encode(self, texts, batch_size=None):
+        self.batch_sizes.append(len(texts))
+        return np.array([[len(text), ord(text[0])] for text in texts], dtype=np.float32)
+
+
+def test_plan_batches_respects_token_budget_and_batch_size():
+    lengths = [5, 40, 10, 40, 5, 20, 10, 5]
+    batches = plan_batches(lengths, token_budget=60, max_batch_size=3)
+
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    for batch in batches:
+        assert len(batch) <= 3
+        # パディング後のトークン数 = 件数 × バッチ内の最大長
+        assert len(batch) * max(lengths[i] for i in batch) <= 60
+
+
+def test_plan_batches_are_in_ascending_length_order():
+    lengths = [30, 1, 20, 2, 10, 3]
+    batches = plan_batches(lengths, token_budget=1000, max_batch_size=2)
+
+    ordered = [lengths[i] for batch in batches for i in batch]
+    assert ordered == sorted(lengths)
+
+
+def test_text_longer_than_budget_gets_its_own_batch():
+    batches = plan_batches([100, 1, 1], token_budget=10)
+    assert batches == [[1, 2], [0]]
+
+
+def test_encode_bucketed_restores_original_order():
+    backend = FakeBackend()
+    texts = ["a" * 30, "b", "c" * 12, "d" * 3, "e" * 30]
+    embeddings, stats = encode_bucketed(backend, texts, token_budget=40, max_batch_size=8)
+
+    np.testing.assert_array_equal(embeddings, [[len(text), ord(text[0])] for text in texts])
+    assert sum(backend.batch_sizes) == len(texts)
+    assert stats["encoded_tokens"] == sum(len(text) for text in texts)
+    assert stats["batches"] == len(backend.batch_sizes)
+    assert "tokens_per_second" in stats
+
+
+def test_encode_bucketed_empty_input():
+    embeddings, stats = encode_bucketed(FakeBackend(), [], token_budget=40)
+    assert embeddings.shape == (0, 0)
+    assert stats["encoded_tokens"] == 0
+
+
+def test_default_token_budget_has_a_floor():
+    assert default_token_budget(1) >= _MIN_TOKEN_BUDGET
+    assert default_token_budget(64) >= default_token_budget(1)
+
+
+def test_pool_shard_returns_token_count(monkeypatch):
+    backend = FakeBackend()
+    monkeypatch.setattr(embedding_pool, "_worker_backend", backend)
+    monkeypatch.setattr(embedding_pool, "_worker_bucketing", None)
+    embeddings, tokens = embedding_pool._encode_shard(["ab", "cde"])
+    assert embeddings.shape == (2, 2)
+    assert tokens == 5
+
+    monkeypatch.setattr(embedding_pool, "_worker_bucketing", {"token_budget": 4})
+    embeddings, tokens = embedding_pool._encode_shard(["ab", "cde"])
+    np.testing.assert_array_equal(embeddings, [[2, ord("a")], [3, ord("c")]])
+    assert tokens == 5
+
+
+class _BrokenExecutor:
+    def __init__(self):
+        self.shut_down = False
+
+    def submit(self, fn, *args):
+        raise BrokenProcessPool("worker died")
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+def test_pool_falls_back_in_process_and_resets_broken_executor(monkeypatch):
+    backend = FakeBackend()
+    monkeypatch.setattr(embedding_registry, "get_embedding_backend", lambda model_name, backend_name: backend)
+    pool = embedding_pool.EmbeddingPool("fake-model", "fake", workers=2, shard_size=2)
+    broken = _BrokenExecutor()
+    pool._executor = broken
+
+    stats = {}
+    texts = ["ab", "c", "def", "g", "hi"]
+    embeddings = pool.encode(texts, stats)
+
+    np.testing.assert_array_equal(embeddings, [[len(text), ord(text[0])] for text in texts])
+    assert stats["encoded_tokens"] == sum(len(text) for text in texts)
+    assert broken.shut_down
+    assert pool._executor is None
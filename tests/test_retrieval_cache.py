@@ -0,0 +1,89 @@
+from utils.retrieval_cache import CachedVectorStore, RetrievalCache
+from utils.vector_store import NumpyVectorStore
+
+
+def _vector(id, values, text):
+    return {"id": id, "values": values, "metadata": {"text_chunk": text}}
+
+
+def _ids(results):
+    return [match["id"] for match in results["matches"]]
+
+
+def test_repeated_query_is_served_from_cache():
+    cache = RetrievalCache(max_entries=10, ttl_seconds=60)
+    store = CachedVectorStore(NumpyVectorStore(name="idx", tenant="t1"), cache)
+    store.upsert([_vector("a", [1.0, 0.0], "a")], "ns")
+
+    assert _ids(store.query([1.0, 0.0], 2, "ns")) == ["a"]
+    assert _ids(store.query([1.0, 0.0], 2, "ns")) == ["a"]
+    assert cache.hits == 1
+
+
+def test_write_invalidates_namespace():
+    cache = RetrievalCache(max_entries=10, ttl_seconds=60)
+    store = CachedVectorStore(NumpyVectorStore(name="idx", tenant="t1"), cache)
+    store.upsert([_vector("a", [1.0, 0.0], "a")], "ns")
+    store.query([1.0, 0.0], 2, "ns")
+
+    store.upsert([_vector("b", [0.9, 0.1], "b")], "ns")
+    assert _ids(store.query([1.0, 0.0], 2, "ns")) == ["a", "b"]
+
+
+def test_write_during_query_does_not_cache_stale_result():
+    cache = RetrievalCache(max_entries=10, ttl_seconds=60)
+    inner = NumpyVectorStore(name="idx", tenant="t1")
+    inner.upsert([_vector("a", [1.0, 0.0], "a")], "ns")
+    store = CachedVectorStore(inner, cache)
+
+    original_query = inner.query
+
+    def query_with_concurrent_write(*args, **kwargs):
+        results = original_query(*args, **kwargs)
+        # 検索結果を返す前に別のセッションが書き込んだ状況
+        store.upsert([_vector("b", [0.9, 0.1], "b")], "ns")
+        return results
+
+    inner.query = query_with_concurrent_write
+    assert _ids(store.query([1.0, 0.0], 2, "ns")) == ["a"]
+
+    inner.query = original_query
+    assert _ids(store.query([1.0, 0.0], 2, "ns")) == ["a", "b"]
+
+
+def test_tenants_with_same_index_name_do_not_share_entries():
+    cache = RetrievalCache(max_entries=10, ttl_seconds=60)
+    store1 = CachedVectorStore(NumpyVectorStore(name="idx", tenant="t1"), cache)
+    store2 = CachedVectorStore(NumpyVectorStore(name="idx", tenant="t2"), cache)
+    store1.upsert([_vector("a", [1.0, 0.0], "a")], "ns")
+    store2.upsert([_vector("z", [1.0, 0.0], "z")], "ns")
+
+    assert _ids(store1.query([1.0, 0.0], 1, "ns")) == ["a"]
+    assert _ids(store2.query([1.0, 0.0], 1, "ns")) == ["z"]
+
+    # 片方のテナントの書き込みで、もう片方のキャッシュは無効にならない
+    generation = cache.generation(store2.scope_name, "ns")
+    store1.upsert([_vector("b", [0.0, 1.0], "b")], "ns")
+    assert cache.generation(store2.scope_name, "ns") == generation
+
+
+def test_expired_entries_are_not_served(monkeypatch):
+    cache = RetrievalCache(max_entries=10, ttl_seconds=60)
+    key = cache.make_key("t1/idx", "ns", [1.0, 0.0], 1)
+    now = [1000.0]
+    monkeypatch.setattr("utils.retrieval_cache.time.monotonic", lambda: now[0])
+    cache.put(key, {"matches": []}, cache.generation("t1/idx", "ns"))
+
+    assert cache.get(key) == {"matches": []}
+    now[0] += 61
+    assert cache.get(key) is None
+
+
+def test_oldest_entry_is_evicted():
+    cache = RetrievalCache(max_entries=2, ttl_seconds=60)
+    keys = [cache.make_key("idx", "ns", [float(i), 1.0], 1) for i in range(3)]
+    for key in keys:
+        cache.put(key, {"matches": []}, 0)
+
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[2]) == {"matches": []}
@@ -0,0 +1,94 @@
+import pytest
+
+from utils.text_splitter import JapaneseTextSplitter
+
+
+def _assert_within_size(splitter, chunks):
+    assert chunks
+    assert all(0 < len(chunk) <= splitter.chunk_size for chunk in chunks)
+
+
+def _overlap(previous, current):
+    """previous の末尾と current の先頭で重なっている文字数"""
+    for size in range(min(len(previous), len(current)), 0, -1):
+        if previous.endswith(current[:size]):
+            return size
+    return 0
+
+
+def test_empty_and_short_text():
+    splitter = JapaneseTextSplitter(chunk_size=100, chunk_overlap=10)
+    assert splitter.split_text("") == []
+    assert splitter.split_text("  \n ") == []
+    assert splitter.split_text(" 短い文。\n") == ["短い文。"]
+
+
+def test_overlap_must_be_smaller_than_chunk_size():
+    with pytest.raises(ValueError):
+        JapaneseTextSplitter(chunk_size=100, chunk_overlap=100)
+
+
+def test_japanese_text_is_cut_at_sentence_ends():
+    sentences = [f"これは{i}番目の文です。" for i in range(40)]
+    splitter = JapaneseTextSplitter(chunk_size=50, chunk_overlap=15)
+    chunks = splitter.split_text("".join(sentences))
+
+    _assert_within_size(splitter, chunks)
+    for chunk in chunks:
+        assert chunk.startswith("これは")
+        assert chunk.endswith("です。")
+    for previous, current in zip(chunks, chunks[1:]):
+        assert _overlap(previous, current) <= splitter.chunk_overlap
+
+
+def test_closing_brackets_stay_with_their_sentence():
+    splitter = JapaneseTextSplitter(chunk_size=15, chunk_overlap=5)
+    chunks = splitter.split_text("「最初の発言です。」次の文が続きます。「最後の発言！」")
+    assert chunks[0] == "「最初の発言です。」"
+    assert "次の文が続きます。" in chunks[1]
+
+
+def test_english_text_is_not_cut_mid_word():
+    words = [f"word{i}" for i in range(400)]
+    text = " ".join(words)
+    splitter = JapaneseTextSplitter(chunk_size=100, chunk_overlap=20)
+    chunks = splitter.split_text(text)
+
+    _assert_within_size(splitter, chunks)
+    for chunk in chunks:
+        assert set(chunk.split()) <= set(words)
+    for previous, current in zip(chunks, chunks[1:]):
+        assert _overlap(previous, current) <= splitter.chunk_overlap
+
+
+def test_english_sentences_are_preferred_over_spaces():
+    text = " ".join(f"Sentence number {i} ends here." for i in range(30))
+    splitter = JapaneseTextSplitter(chunk_size=100, chunk_overlap=20)
+    chunks = splitter.split_text(text)
+
+    _assert_within_size(splitter, chunks)
+    assert all(chunk.startswith("Sentence") and chunk.endswith("here.") for chunk in chunks)
+
+
+def test_text_without_boundaries_is_cut_at_chunk_size():
+    splitter = JapaneseTextSplitter(chunk_size=100, chunk_overlap=10)
+    chunks = splitter.split_text("あ" * 250)
+
+    _assert_within_size(splitter, chunks)
+    assert chunks[0] == "あ" * 100
+
+
+def test_chunks_cover_the_whole_text():
+    text = "".join(f"第{i}段落の内容です。English part {i} follows.\n" for i in range(50))
+    splitter = JapaneseTextSplitter(chunk_size=120, chunk_overlap=30)
+    chunks = splitter.split_text(text)
+
+    _assert_within_size(splitter, chunks)
+    position = 0
+    for chunk in chunks:
+        found = text.find(chunk, max(0, position - splitter.chunk_overlap - len(chunk)))
+        assert found >= 0
+        # 前のチャンクの終わりより後ろに飛ばしていない（途中の文字が抜けていない）
+        assert not text[position:found].strip()
+        position = max(position, found + len(chunk))
+    assert not text[position:].strip()
@@ -0,0 +1,128 @@
+import textwrap
+import pytest
+from utils.url_policy import NgUrlMatcher, RedirectResolver, UnsafeUrlError, canonicalize_url, ensure_public_url
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("HTTPS://Example.COM/Path/", "https://example.com/Path"),
+    ("example.com", "https://example.com/"),
+    ("http://example.com:80/a", "http://example.com/a"),
+    ("https://example.com:8443/a", "https://example.com:8443/a"),
+    ("https://example.com/a#section", "https://example.com/a"),
+    ("https://example.com/a?utm_source=x&b=2&a=1&fbclid=y", "https://example.com/a?a=1&b=2"),
+    ("  https://example.com/  ", "https://example.com/"),
+    ("http://[::1]:8080/x", "http://[::1]:8080/x"),
+    ("http://[2001:DB8::1]/x", "http://[2001:db8::1]/x"),
+])
+def test_canonicalize_url(url, expected):
+    assert canonicalize_url(url) == expected
+
+
+def test_canonicalize_url_is_idempotent():
+    url = "https://Example.com/a/?b=2&utm_medium=x&a=1"
+    assert canonicalize_url(canonicalize_url(url)) == canonicalize_url(url)
+
+
+def test_canonicalize_url_falls_back_on_invalid_port():
+    assert canonicalize_url(" http://example.com:abc/ ") == "http://example.com:abc/"
+
+
+class _Response:
+    def __init__(self, url):
+        self.url = url
+
+
+class _Session:
+    def __init__(self, redirects):
+        self.redirects = redirects
+        self.requested = []
+
+    def head(self, url, allow_redirects, timeout):
+        self.requested.append(url)
+        return _Response(self.redirects.get(url, url))
+
+
+def test_redirect_resolver_requests_entered_url_and_caches_by_canonical_url():
+    session = _Session({"https://example.com/old/?utm_source=x": "https://example.com/new/"})
+    resolver = RedirectResolver(session)
+
+    assert resolver.resolve("https://example.com/old/?utm_source=x") == "https://example.com/new"
+    assert resolver.resolve("https://EXAMPLE.com/old") == "https://example.com/new"
+    assert session.requested == ["https://example.com/old/?utm_source=x"]
+
+
+@pytest.fixture
+def ng_module(tmp_path, monkeypatch):
+    module_path = tmp_path / "ng_url_list_for_test.py"
+    module_path.write_text(textwrap.dedent("""
+        ng_urls = [
+            "https://www.youtube.com",
+            "example.com/private",
+        ]
+    """))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    return "ng_url_list_for_test"
+
+
+def test_ng_matcher_matches_host_suffix(ng_module):
+    matcher = NgUrlMatcher(module_name=ng_module)
+    assert matcher.is_ng("https://youtube.com/watch?v=1")
+    assert matcher.is_ng("https://m.youtube.com/watch?v=1")
+    assert not matcher.is_ng("https://notyoutube.com/")
+
+
+def test_ng_matcher_matches_path_prefix_on_segment_boundary(ng_module):
+    matcher = NgUrlMatcher(module_name=ng_module)
+    assert matcher.is_ng("https://example.com/private")
+    assert matcher.is_ng("https://example.com/private/page")
+    assert not matcher.is_ng("https://example.com/privatex")
+    assert not matcher.is_ng("https://example.com/public")
+
+
+def test_ng_matcher_includes_extra_patterns(ng_module):
+    matcher = NgUrlMatcher(module_name=ng_module, extra_patterns=lambda: ["blocked.example.org"])
+    assert matcher.is_ng("https://blocked.example.org/a")
+
+
+def test_ng_matcher_does_not_raise_on_unparsable_urls(ng_module):
+    matcher = NgUrlMatcher(module_name=ng_module)
+    assert not matcher.is_ng("http://example.com:abc/")
+    assert not matcher.is_ng("http://[::1/")
+    assert not matcher.is_ng("")
+
+
+def _resolver(*addresses):
+    def resolve(host, port):
+        return [(None, None, None, "", (address, port)) for address in addresses]
+    return resolve
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/",
+    "http://localhost:8080/admin",
+    "http://[::1]/",
+    "http://10.0.0.5/",
+    "http://192.168.1.1/",
+    "http://169.254.169.254/latest/meta-data",
+    "http://[::ffff:127.0.0.1]/",
+    "http://0.0.0.0/",
+    "ftp://example.com/",
+    "http://example.com:abc/",
+])
+def test_ensure_public_url_rejects_internal_addresses(url):
+    with pytest.raises(UnsafeUrlError):
+        ensure_public_url(url)
+
+
+def test_ensure_public_url_checks_every_resolved_address():
+    ensure_public_url("https://example.com/", resolve=_resolver("93.184.216.34"))
+    with pytest.raises(UnsafeUrlError):
+        ensure_public_url("https://example.com/", resolve=_resolver("93.184.216.34", "10.0.0.1"))
+
+
+def test_ensure_public_url_rejects_unresolvable_hosts():
+    def resolve(host, port):
+        raise OSError("name resolution failed")
+
+    with pytest.raises(UnsafeUrlError):
+        ensure_public_url("https://example.invalid/", resolve=resolve)
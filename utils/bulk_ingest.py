@@ -0,0 +1,223 @@
+import logging
+import queue
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+import utils.scraping_helper as sh
+from utils.url_policy import canonicalize_url
+from config.pipeline import BULK_EXTRACT_WORKERS, BULK_UPSERT_WORKERS, BULK_QUEUE_SIZE, BULK_SITEMAP_MAX_URLS
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+def dedupe_urls(urls):
+    """正規化したURLが同じものを除き、入力されたURLのまま入力順に返す。"""
+    seen = set()
+    unique_urls = []
+    for url in urls:
+        canonical = canonicalize_url(url)
+        if canonical not in seen:
+            seen.add(canonical)
+            unique_urls.append(url)
+    return unique_urls
+
+
+def parse_url_list(text):
+    """改行・空白区切りのURLの一覧を、正規化したURLで重複を除き入力順に返す。"""
+    return dedupe_urls(url for url in text.split() if url.startswith(("http://", "https://")))
+
+
+def load_sitemap_urls(sitemap_url, max_urls=BULK_SITEMAP_MAX_URLS):
+    """
+    サイトマップ（サイトマップインデックスを含む）からページのURLを取得する。
+
+    内部ネットワークのアドレスのサイトマップは取得せず、UnsafeUrlError を送出する。
+    """
+    urls = []
+    pending = [sitemap_url]
+    visited = set()
+    while pending and len(urls) < max_urls:
+        current = pending.pop(0)
+        if current in visited:
+            continue
+        visited.add(current)
+        response = sh.http_session.get(current, timeout=10)
+        response.raise_for_status()
+        root = ET.fromstring(response.content)
+        # 名前空間付きのタグ名から末尾のローカル名だけを見る
+        for element in root.iter():
+            if not element.tag.endswith("loc") or not element.text:
+                continue
+            loc = element.text.strip()
+            if root.tag.endswith("sitemapindex"):
+                pending.append(loc)
+            else:
+                urls.append(loc)
+    return dedupe_urls(urls)[:max_urls]
+
+
+def url_document(url):
+    return {"type": "url", "source": url}
+
+
+def pdf_document(pdf_file):
+    return {"type": "pdf", "source": pdf_file.name, "file": pdf_file}
+
+
+def find_duplicate_pdfs(documents):
+    """
+    先に出てきたPDFと同じファイル名のPDFの位置を返す。
+
+    PDFはファイル名からソースIDを作るため、同じ名前のPDFを登録すると後の登録が先のベクトルIDを
+    カタログから上書きし、先のPDFのベクトルが削除できなくなる。
+    """
+    seen = set()
+    duplicates = set()
+    for position, document in enumerate(documents):
+        if document["type"] != "pdf":
+            continue
+        if document["source"] in seen:
+            duplicates.add(position)
+        seen.add(document["source"])
+    return duplicates
+
+
+def _extract(document):
+    """ドキュメントを取得してチャンクに分割する。"""
+    if document["type"] == "url":
+        if sh.is_ng_url(document["source"]):
+            raise ValueError("このURLは読み込めません")
+        scraped_data = sh.scrape_url(document["source"])
+        if not scraped_data:
+            raise ValueError("スクレイピング結果がありませんでした")
+        combined_text, metadata_list = sh.prepare_text_and_metadata(sh.extract_keys_from_json(scraped_data))
+        return sh.split_text(combined_text), metadata_list
+    pdf_text = sh.extract_text_from_pdf(document["file"])
+    return sh.split_text(pdf_text), None
+
+
+def _store(index, document, chunks, embeddings, metadata_list, namespace, catalog_service):
+    """ベクトルを保存し、カタログがあれば記録する。"""
+    if document["type"] == "url":
+        source_id = sh.make_source_id("url", metadata_list[0]['original_url'])
+        title = metadata_list[0]['title']
+    else:
+        source_id = sh.make_source_id("pdf", document["source"])
+        title = document["source"]
+    existing_ids = catalog_service.get_vector_ids(namespace, source_id) if catalog_service else None
+
+    if document["type"] == "url":
+        stats = sh.store_data_in_pinecone(index, embeddings, chunks, metadata_list, namespace, existing_ids=existing_ids)
+    else:
+        stats = sh.store_pdf_data_in_pinecone(index, embeddings, chunks, document["source"], namespace, existing_ids=existing_ids)
+
+    if catalog_service:
+        catalog_service.record_source(namespace, source_id, document["type"], title, stats['vector_ids'])
+    return stats
+
+
+def run_bulk_ingestion(index, documents, namespace, catalog_service=None, progress_callback=None,
+                       extract_workers=BULK_EXTRACT_WORKERS, upsert_workers=BULK_UPSERT_WORKERS,
+                       queue_size=BULK_QUEUE_SIZE):
+    """
+    複数のURL・PDFを、取得→埋め込み→アップロードの段階に分けたパイプラインで登録する。
+
+    取得とアップロードは複数スレッド、埋め込みはモデルを共有する一つのスレッドで行い、
+    ドキュメントをまたいで各段階を並行させる。段階の間のキューには上限を設けてメモリ使用量を抑える。
+    progress_callback はこの関数を呼び出したスレッドから呼ばれるため、Streamlitの描画に使える。
+
+    :param documents: url_document / pdf_document で作ったドキュメントのリスト。同じファイル名のPDFは最初の一つだけを登録し、残りはエラーとして返す
+    :param progress_callback: progress_callback(完了件数, 全件数, 完了したドキュメントの結果) の形で進捗を通知する関数
+    :return: ドキュメントごとの結果のリスト
+    """
+    events = queue.Queue()
+    embed_queue = queue.Queue(maxsize=queue_size)
+    upsert_queue = queue.Queue(maxsize=queue_size)
+    # 同じ名前のドキュメントがありうるため、入力の位置ごとに記録する
+    started_at = {}
+
+    def _report(position, document, status, message="", stats=None):
+        events.put({
+            "source": document["source"],
+            "type": document["type"],
+            "status": status,
+            "message": message,
+            "chunks": (stats or {}).get("total_chunks", 0),
+            "upserted": (stats or {}).get("upserted", 0),
+            "deleted": (stats or {}).get("deleted", 0),
+            "seconds": round(time.perf_counter() - started_at[position], 1),
+        })
+
+    duplicates = find_duplicate_pdfs(documents)
+
+    def _extract_stage(position):
+        document = documents[position]
+        started_at[position] = time.perf_counter()
+        if position in duplicates:
+            _report(position, document, "error", "同じファイル名のPDFが既にあるため登録しません（ファイル名を変えてください）")
+            return
+        try:
+            chunks, metadata_list = _extract(document)
+        except Exception as e:
+            logger.warning(f"一括登録: 取得に失敗しました {document['source']}: {e}")
+            _report(position, document, "error", f"取得に失敗: {e}")
+            return
+        embed_queue.put((position, document, chunks, metadata_list))
+
+    def _embed_stage():
+        while True:
+            item = embed_queue.get()
+            if item is _DONE:
+                for _ in range(upsert_workers):
+                    upsert_queue.put(_DONE)
+                return
+            position, document, chunks, metadata_list = item
+            try:
+                embeddings, embed_stats = sh.make_chunks_embeddings(chunks, return_stats=True)
+            except Exception as e:
+                logger.warning(f"一括登録: 埋め込みに失敗しました {document['source']}: {e}")
+                _report(position, document, "error", f"埋め込みに失敗: {e}")
+                continue
+            upsert_queue.put((position, document, chunks, embeddings, metadata_list, embed_stats))
+
+    def _upsert_stage():
+        while True:
+            item = upsert_queue.get()
+            if item is _DONE:
+                return
+            position, document, chunks, embeddings, metadata_list, embed_stats = item
+            try:
+                stats = _store(index, document, chunks, embeddings, metadata_list, namespace, catalog_service)
+            except Exception as e:
+                logger.warning(f"一括登録: アップロードに失敗しました {document['source']}: {e}")
+                _report(position, document, "error", f"アップロードに失敗: {e}")
+                continue
+            _report(position, document, "success", stats={**stats, **embed_stats})
+
+    threads = [threading.Thread(target=_embed_stage, name="bulk-embed", daemon=True)]
+    threads += [threading.Thread(target=_upsert_stage, name=f"bulk-upsert-{i}", daemon=True) for i in range(upsert_workers)]
+    for thread in threads:
+        thread.start()
+
+    def _extract_all():
+        with ThreadPoolExecutor(max_workers=extract_workers, thread_name_prefix="bulk-extract") as executor:
+            list(executor.map(_extract_stage, range(len(documents))))
+        embed_queue.put(_DONE)
+
+    threading.Thread(target=_extract_all, name="bulk-extract-all", daemon=True).start()
+
+    results = []
+    while len(results) < len(documents):
+        result = events.get()
+        results.append(result)
+        if progress_callback:
+            progress_callback(len(results), len(documents), result)
+
+    for thread in threads:
+        thread.join()
+    succeeded = sum(1 for result in results if result["status"] == "success")
+    logger.info(f"一括登録: {succeeded}/{len(documents)}件成功")
+    return results
@@ -0,0 +1,128 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# SQLiteの1クエリあたりのプレースホルダ数の上限を超えないようにする
+_SQL_BATCH_SIZE = 500
+
+
+def chunk_key(model_id, chunk):
+    """チャンク本文とモデルIDから内容アドレスのキーを作る。"""
+    return hashlib.sha256(f"{model_id}\n{chunk}".encode("utf-8")).hexdigest()
+
+
+class ChunkEmbeddingStore:
+    """
+    チャンク本文のハッシュをキーにした埋め込みベクトルのディスクストア。
+
+    同じURLやPDFを再登録した場合、既に見たチャンクは保存済みのベクトルを再利用し、
+    新しいチャンクだけをエンコーダーに渡す。件数が上限を超えたら最終利用が古いものから削除する。
+    """
+
+    def __init__(self, path, dtype="float16", max_entries=200000):
+        if dtype not in ("float16", "float32"):
+            raise ValueError("dtype must be 'float16' or 'float32'")
+        self.dtype = np.dtype(dtype)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_embeddings ("
+            "key TEXT PRIMARY KEY, dtype TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_chunk_embeddings_last_used ON chunk_embeddings (last_used)")
+        self._db.commit()
+
+    def get_many(self, keys):
+        """キーのリストを受け取り、保存済みのものだけ {key: ベクトル(float32)} で返す。"""
+        found = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(keys), _SQL_BATCH_SIZE):
+                batch = keys[start:start + _SQL_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._db.execute(
+                    f"SELECT key, dtype, vector FROM chunk_embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, dtype, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=dtype).astype(np.float32)
+                if rows:
+                    self._db.executemany(
+                        "UPDATE chunk_embeddings SET last_used = ? WHERE key = ?",
+                        [(now, row[0]) for row in rows],
+                    )
+            self._db.commit()
+        return found
+
+    def put_many(self, keys, embeddings):
+        now = time.time()
+        rows = [
+            (key, self.dtype.name, np.asarray(embedding, dtype=self.dtype).tobytes(), now)
+            for key, embedding in zip(keys, embeddings)
+        ]
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO chunk_embeddings (key, dtype, vector, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            self._db.commit()
+        self.evict()
+
+    def evict(self):
+        """件数が上限を超えている場合、最終利用が古いものから削除する。削除件数を返す。"""
+        with self._lock:
+            count = self._db.execute("SELECT COUNT(*) FROM chunk_embeddings").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow <= 0:
+                return 0
+            self._db.execute(
+                "DELETE FROM chunk_embeddings WHERE key IN "
+                "(SELECT key FROM chunk_embeddings ORDER BY last_used ASC LIMIT ?)",
+                (overflow,),
+            )
+            self._db.commit()
+        logger.info(f"チャンク埋め込みストアから{overflow}件を削除しました")
+        return overflow
+
+    def embed_with_cache(self, model_id, chunks, encode):
+        """
+        保存済みのチャンクはストアから、新しいチャンクだけ encode(chunks) で埋め込みを作る。
+
+        :param model_id: モデル（とバックエンド）を識別する文字列
+        :param chunks: チャンク本文のリスト
+        :param encode: 未登録チャンクのリストを受け取り埋め込みの配列を返す関数
+        :return: (元の順序の埋め込み配列, 統計情報の辞書)
+        """
+        keys = [chunk_key(model_id, chunk) for chunk in chunks]
+        cached = self.get_many(list(set(keys)))
+
+        # 同じドキュメント内の重複チャンクも一度だけエンコードする
+        new_keys = []
+        new_chunks = []
+        seen = set(cached)
+        for key, chunk in zip(keys, chunks):
+            if key not in seen:
+                seen.add(key)
+                new_keys.append(key)
+                new_chunks.append(chunk)
+
+        vectors = dict(cached)
+        if new_chunks:
+            new_embeddings = np.asarray(encode(new_chunks), dtype=np.float32)
+            self.put_many(new_keys, new_embeddings)
+            vectors.update(zip(new_keys, new_embeddings))
+
+        embeddings = np.stack([vectors[key] for key in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
+        stats = {
+            "total_chunks": len(chunks),
+            "reused_chunks": sum(1 for key in keys if key in cached),
+            "encoded_chunks": len(new_chunks),
+        }
+        return embeddings, stats
@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from utils.vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+# インデックスからは外し、ローカルのストアに保存するメタデータのキー
+BULKY_METADATA_KEYS = ("text_chunk", "description", "keywords")
+
+# SQLiteの1クエリあたりのプレースホルダ数の上限を超えないようにする
+_SQL_BATCH_SIZE = 500
+
+
+class ChunkTextStore:
+    """
+    (ストア名, ネームスペース, ベクトルID) をキーにチャンク本文などのメタデータを保存するSQLiteストア。
+
+    ストア名には VectorStore.scope_name（APIキーのハッシュとインデックス名）を使い、
+    同じインデックス名を使う別のテナントの行と混ざらないようにする。
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_texts ("
+            "store_name TEXT NOT NULL, namespace TEXT NOT NULL, vector_id TEXT NOT NULL, payload TEXT NOT NULL, "
+            "PRIMARY KEY (store_name, namespace, vector_id))"
+        )
+        self._db.commit()
+
+    def put_many(self, store_name, namespace, payloads):
+        rows = [
+            (store_name, namespace, vector_id, json.dumps(payload, ensure_ascii=False))
+            for vector_id, payload in payloads.items()
+        ]
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO chunk_texts (store_name, namespace, vector_id, payload) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._db.commit()
+
+    def get_many(self, store_name, namespace, vector_ids):
+        """IDのリストをまとめて引き、{ベクトルID: メタデータ} を返す。"""
+        vector_ids = list(vector_ids)
+        found = {}
+        with self._lock:
+            for start in range(0, len(vector_ids), _SQL_BATCH_SIZE):
+                batch = vector_ids[start:start + _SQL_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._db.execute(
+                    f"SELECT vector_id, payload FROM chunk_texts "
+                    f"WHERE store_name = ? AND namespace = ? AND vector_id IN ({placeholders})",
+                    [store_name, namespace, *batch],
+                ).fetchall()
+                found.update((vector_id, json.loads(payload)) for vector_id, payload in rows)
+        return found
+
+    def delete_many(self, store_name, namespace, vector_ids):
+        vector_ids = list(vector_ids)
+        with self._lock:
+            for start in range(0, len(vector_ids), _SQL_BATCH_SIZE):
+                batch = vector_ids[start:start + _SQL_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                self._db.execute(
+                    f"DELETE FROM chunk_texts WHERE store_name = ? AND namespace = ? AND vector_id IN ({placeholders})",
+                    [store_name, namespace, *batch],
+                )
+            self._db.commit()
+
+    def delete_namespace(self, store_name, namespace):
+        with self._lock:
+            self._db.execute("DELETE FROM chunk_texts WHERE store_name = ? AND namespace = ?", (store_name, namespace))
+            self._db.commit()
+
+
+class SlimMetadataVectorStore(VectorStore):
+    """
+    インデックスにはフィルタに使う軽いメタデータだけを保存し、
+    チャンク本文などの大きなメタデータはローカルのChunkTextStoreに保存するVectorStore。
+
+    検索時はtop-kが決まった後に、ローカルのストアから一度にまとめて本文を取得して結果に戻す。
+    """
+
+    def __init__(self, inner, text_store, bulky_keys=BULKY_METADATA_KEYS):
+        self.inner = inner
+        self.name = inner.name
+        self.tenant = inner.tenant
+        self.text_store = text_store
+        self.bulky_keys = bulky_keys
+
+    def upsert(self, vectors, namespace):
+        slim_vectors = []
+        payloads = {}
+        for vector in vectors:
+            metadata = dict(vector.get("metadata") or {})
+            payload = {key: metadata.pop(key) for key in self.bulky_keys if key in metadata}
+            if payload:
+                payloads[vector["id"]] = payload
+            slim_vectors.append({**vector, "metadata": metadata})
+        # 検索で本文が欠けないよう、インデックスより先にローカルへ保存する
+        self.text_store.put_many(self.scope_name, namespace, payloads)
+        return self.inner.upsert(slim_vectors, namespace)
+
+    def _hydrate(self, records, namespace):
+        payloads = self.text_store.get_many(self.scope_name, namespace, [record["id"] for record in records])
+        for record in records:
+            if record["id"] in payloads:
+                record["metadata"] = {**record.get("metadata", {}), **payloads[record["id"]]}
+        return records
+
+    def query(self, vector, top_k, namespace, include_metadata=True, filter=None):
+        results = self.inner.query(vector, top_k, namespace, include_metadata=include_metadata, filter=filter)
+        if include_metadata and results["matches"]:
+            self._hydrate(results["matches"], namespace)
+        return results
+
+    def fetch(self, ids, namespace):
+        vectors = self.inner.fetch(ids, namespace)
+        self._hydrate(list(vectors.values()), namespace)
+        return vectors
+
+    def list_ids(self, prefix, namespace):
+        return self.inner.list_ids(prefix, namespace)
+
+    def delete(self, ids, namespace):
+        ids = list(ids)
+        self.inner.delete(ids, namespace)
+        self.text_store.delete_many(self.scope_name, namespace, ids)
+
+    def delete_all(self, namespace):
+        self.inner.delete_all(namespace)
+        self.text_store.delete_namespace(self.scope_name, namespace)
+
+    def list_namespaces(self):
+        return self.inner.list_namespaces()
+
+    def namespace_vector_count(self, namespace):
+        return self.inner.namespace_vector_count(namespace)
+
+    def flush(self):
+        return self.inner.flush()
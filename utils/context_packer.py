@@ -0,0 +1,163 @@
+import logging
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# LLMに渡しても生成の役に立たないメタデータのキー
+DROPPED_METADATA_KEYS = ("keywords", "source_id")
+# 重複を取り除く対象のメタデータのキー（一度出たら以降は省略する）
+DEDUPED_METADATA_KEYS = ("title", "description", "original_url", "pdf_filename")
+# チャンク同士の重なりとみなす最小文字数
+MIN_OVERLAP_CHARS = 30
+MAX_OVERLAP_CHARS = 300
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+
+def count_tokens(text):
+    """トークン数を返す。tiktokenが無い場合は文字種から概算する。"""
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # 日本語はおおよそ1文字1トークン、英数字はおおよそ4文字1トークン
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+def truncate_to_tokens(text, max_tokens):
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text, disallowed_special=())[:max_tokens])
+    # 概算の場合は二分探索で収まる長さを探す
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
+
+
+def _normalize(text):
+    return " ".join(unicodedata.normalize("NFKC", str(text)).split())
+
+
+def _overlap_length(previous, current):
+    """previous の末尾と current の先頭が重なっている文字数を返す。"""
+    for size in range(min(MAX_OVERLAP_CHARS, len(previous), len(current)), MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(current[:size]):
+            return size
+    return 0
+
+
+def dedupe_chunks(chunks, kept_chunks):
+    """
+    既に採用したチャンクと重複・包含しているものを除き、前後の重なり部分を取り除く。
+
+    重複の判定は正規化（NFKC・空白の統一）したテキストで行い、返すチャンクは改行などを残した元のテキストのままにする。
+
+    :param chunks: 新しいチャンクのリスト
+    :param kept_chunks: 既に採用したチャンクの (正規化したテキスト, 元のテキスト) のリスト（このリストに追記していく）
+    :return: 採用するチャンクのリスト（重複していたものはNone）
+    """
+    results = []
+    for chunk in chunks:
+        if not chunk:
+            results.append(chunk)
+            continue
+        normalized = _normalize(chunk)
+        if any(normalized in kept for kept, _ in kept_chunks):
+            results.append(None)
+            continue
+        # 分割時の重なりは元のテキストがそのまま一致するため、元のテキスト同士で取り除く
+        trimmed = chunk
+        for _, kept_raw in kept_chunks:
+            overlap = _overlap_length(kept_raw, trimmed)
+            if overlap:
+                trimmed = trimmed[overlap:]
+        kept_chunks.append((normalized, chunk))
+        results.append(trimmed)
+    return results
+
+
+def format_matches(metadata_list, seen_values, kept_chunks):
+    """メタデータのリストを、冗長な項目と重複するチャンクを除いて一つのテキストにする。"""
+    blocks = []
+    chunks = dedupe_chunks([metadata.get("text_chunk", "") for metadata in metadata_list], kept_chunks)
+    for metadata, chunk in zip(metadata_list, chunks):
+        if chunk is None:
+            continue
+        lines = []
+        for key, value in metadata.items():
+            if key in DROPPED_METADATA_KEYS or key == "text_chunk" or value in ("", None, []):
+                continue
+            if key in DEDUPED_METADATA_KEYS:
+                seen_key = (key, _normalize(value))
+                if seen_key in seen_values:
+                    continue
+                seen_values.add(seen_key)
+            lines.append(f"{key}: {value}")
+        if chunk:
+            lines.append(f"text_chunk: {chunk}")
+        if lines:
+            blocks.append("\n".join(lines))
+    return blocks
+
+
+def pack_context(matches_by_ns, token_budget, weights=None):
+    """
+    ネームスペースごとの検索結果を、重みに応じて配分したトークン予算に収まるよう整形する。
+
+    予算を使い切らなかったネームスペースの残りは、他のネームスペースに重みに応じて再配分する。
+    各ネームスペースでは上位の結果から順に採用し、最後の結果は予算に収まるように切り詰める。
+
+    :param matches_by_ns: {ネームスペース: メタデータのリスト（上位から順）}
+    :param token_budget: 全ネームスペース合計のトークン数の上限
+    :param weights: {ネームスペース: 重み}（指定が無いネームスペースは1。0以下のネームスペースは使わない）
+    :return: {ネームスペース: LLMに渡すテキスト}
+    """
+    weights = weights or {}
+    matches_by_ns = {ns: metadata_list for ns, metadata_list in matches_by_ns.items() if weights.get(ns, 1.0) > 0}
+    seen_values = set()
+    kept_chunks = []
+    # 重複の除去は上位のネームスペースを優先するため、渡された順に行う
+    blocks_by_ns = {
+        ns: format_matches(metadata_list, seen_values, kept_chunks)
+        for ns, metadata_list in matches_by_ns.items()
+    }
+    tokens_by_ns = {ns: [count_tokens(block) for block in blocks] for ns, blocks in blocks_by_ns.items()}
+
+    # 必要量が少ないネームスペースから予算を確定させ、余りを残りに再配分する
+    allocations = {}
+    remaining_budget = token_budget
+    pending = sorted(blocks_by_ns, key=lambda ns: sum(tokens_by_ns[ns]) / weights.get(ns, 1.0))
+    while pending:
+        total_weight = sum(weights.get(ns, 1.0) for ns in pending)
+        ns = pending.pop(0)
+        share = int(remaining_budget * weights.get(ns, 1.0) / total_weight) if total_weight else 0
+        allocations[ns] = min(share, sum(tokens_by_ns[ns]))
+        remaining_budget -= allocations[ns]
+
+    packed = {}
+    for ns, blocks in blocks_by_ns.items():
+        budget = allocations[ns]
+        selected = []
+        for block, tokens in zip(blocks, tokens_by_ns[ns]):
+            if tokens <= budget:
+                selected.append(block)
+                budget -= tokens
+            else:
+                truncated = truncate_to_tokens(block, budget)
+                if truncated:
+                    selected.append(truncated)
+                break
+        if selected:
+            packed[ns] = "\n\n".join(selected)
+    return packed
@@ -0,0 +1,144 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CompressedDiskCache:
+    """
+    JSONにできる値をgzip圧縮してローカルディスクに保存するキャッシュ。
+
+    有効期限(TTL)と合計サイズの上限を持ち、上限を超えたら最終利用が古いものから削除する。
+    ファイル単位で保存するため、同じホストの複数プロセスから共有できる。
+    """
+
+    def __init__(self, directory, ttl_seconds=None, max_bytes=500 * 1024 * 1024):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json.gz")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        if self.ttl_seconds is not None and time.time() - entry["stored_at"] > self.ttl_seconds:
+            self.misses += 1
+            return None
+
+        # 最終利用日時を更新して、サイズ超過時に削除されにくくする
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return entry["value"]
+
+    def put(self, key, value):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump({"key": key, "stored_at": time.time(), "value": value}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def list_writer(self, key):
+        """
+        リストの値を1要素ずつディスクに書き出す ListWriter を返す。
+
+        要素をメモリに溜めずに保存でき、commit() するまでは get() から見えない。
+        """
+        return ListWriter(self, key)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """合計サイズが上限を超えている場合、最終利用が古いものから削除する。削除件数を返す。"""
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.directory):
+                if not name.endswith(".json.gz"):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+        if removed:
+            logger.info(f"{self.directory} から{removed}件のキャッシュを削除しました")
+        return removed
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+class ListWriter:
+    """CompressedDiskCache にリストの値を1要素ずつ書き出す。commit() で保存し、abort() で破棄する。"""
+
+    def __init__(self, cache, key):
+        self._cache = cache
+        self._path = cache._path(key)
+        self._tmp_path = f"{self._path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self._file = gzip.open(self._tmp_path, "wt", encoding="utf-8")
+        # get() と同じ形式になるよう、値のリストの開き括弧までを先に書く
+        header = json.dumps({"key": key, "stored_at": time.time()}, ensure_ascii=False)
+        self._file.write(header[:-1] + ', "value": [')
+        self._count = 0
+
+    def append(self, item):
+        if self._count:
+            self._file.write(", ")
+        json.dump(item, self._file, ensure_ascii=False)
+        self._count += 1
+
+    def commit(self):
+        self._file.write("]}")
+        self._file.close()
+        os.replace(self._tmp_path, self._path)
+        self._cache.evict()
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,126 @@
+import logging
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBackend:
+    """埋め込みバックエンドの共通インターフェース。"""
+
+    name = "base"
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    @property
+    def model_id(self):
+        # バックエンドによってベクトルが変わるため、キャッシュのキーにはこちらを使う
+        return f"{self.model_name}:{self.name}"
+
+    def encode(self, texts, batch_size=None):
+        """テキストのリストを受け取り、float32の埋め込み行列を返す。"""
+        raise NotImplementedError
+
+    def count_tokens(self, texts):
+        """各テキストのトークン数のリストを返す。トークナイザーが無いバックエンドでは文字数で代用する。"""
+        return [len(text) for text in texts]
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """従来どおりのPyTorch(フル精度)によるSentenceTransformer。"""
+
+    name = "torch"
+
+    def __init__(self, model_name):
+        super().__init__(model_name)
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device="cpu")
+
+    def encode(self, texts, batch_size=None):
+        if batch_size is None:
+            return np.asarray(self.model.encode(texts), dtype=np.float32)
+        return np.asarray(self.model.encode(texts, batch_size=batch_size), dtype=np.float32)
+
+    def count_tokens(self, texts):
+        # モデルに入る長さ（max_seq_lengthで切り詰めた後）で数える
+        encoded = self.model.tokenizer(
+            list(texts), add_special_tokens=True, truncation=True, max_length=self.model.max_seq_length
+        )
+        return [len(ids) for ids in encoded["input_ids"]]
+
+
+class QuantizedTorchBackend(SentenceTransformerBackend):
+    """Linear層をint8に動的量子化したCPU向けのSentenceTransformer。"""
+
+    name = "torch-int8"
+
+    def __init__(self, model_name):
+        super().__init__(model_name)
+        import torch
+        self.model = torch.quantization.quantize_dynamic(
+            self.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        )
+
+
+BACKENDS = {
+    SentenceTransformerBackend.name: SentenceTransformerBackend,
+    QuantizedTorchBackend.name: QuantizedTorchBackend,
+}
+
+
+def create_backend(backend_name, model_name):
+    if backend_name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend_name} (available: {list(BACKENDS)})")
+    return BACKENDS[backend_name](model_name)
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.clip(norms, 1e-12, None)
+
+
+def compare_backends(texts, model_name, reference="torch", candidates=("torch-int8",), top_k=5):
+    """
+    現行のベクトルを基準に、各バックエンドの精度とスループットを比較する。
+
+    :param texts: 比較に使うチャンクのリスト（実際のPDFから作ったものを推奨）
+    :return: バックエンド名ごとの結果の辞書
+        - texts_per_second: 1秒あたりのエンコード件数
+        - mean_cosine / min_cosine: 基準ベクトルとのコサイン類似度
+        - top_k_overlap: チャンク同士の近傍top_kが基準とどれだけ一致するか
+    """
+    results = {}
+    reference_vectors = None
+    reference_neighbors = None
+
+    for backend_name in (reference, *candidates):
+        backend = create_backend(backend_name, model_name)
+        backend.encode(texts[:1])  # 初回呼び出しのオーバーヘッドを除外する
+
+        started = time.perf_counter()
+        vectors = _normalize_rows(backend.encode(texts))
+        elapsed = time.perf_counter() - started
+
+        similarity = vectors @ vectors.T
+        np.fill_diagonal(similarity, -np.inf)
+        k = min(top_k, len(texts) - 1)
+        neighbors = np.argsort(-similarity, axis=1)[:, :k] if k > 0 else None
+
+        result = {"texts_per_second": round(len(texts) / elapsed, 1) if elapsed else None}
+        if reference_vectors is None:
+            reference_vectors = vectors
+            reference_neighbors = neighbors
+        else:
+            cosine = np.sum(vectors * reference_vectors, axis=1)
+            result["mean_cosine"] = round(float(cosine.mean()), 4)
+            result["min_cosine"] = round(float(cosine.min()), 4)
+            if neighbors is not None:
+                overlap = [
+                    len(set(a) & set(b)) / k for a, b in zip(neighbors, reference_neighbors)
+                ]
+                result["top_k_overlap"] = round(float(np.mean(overlap)), 4)
+        results[backend_name] = result
+        logger.info(f"{backend_name}: {result}")
+
+    return results
@@ -0,0 +1,155 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# ワーカープロセスごとに一つだけ保持するバックエンドとバッチ分けの設定
+_worker_backend = None
+_worker_bucketing = None
+
+
+def _init_worker(model_name, backend_name, num_threads, bucketing=False, token_budget=None):
+    global _worker_backend, _worker_bucketing
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    import torch
+    # ワーカー同士でコアを奪い合わないようにスレッド数を割り当てる
+    torch.set_num_threads(num_threads)
+    from utils.embedding_backend import create_backend
+    _worker_backend = create_backend(backend_name, model_name)
+    if bucketing:
+        from utils.embedding_scheduler import default_token_budget
+        # ワーカーに割り当てたコア数に合わせてバッチの大きさを決める
+        _worker_bucketing = {"token_budget": token_budget or default_token_budget(num_threads)}
+
+
+def _encode_texts(backend, bucketing, texts):
+    """:return: (埋め込み行列, トークン数)"""
+    if bucketing is None:
+        return backend.encode(texts), int(sum(backend.count_tokens(texts)))
+    from utils.embedding_scheduler import encode_bucketed
+    embeddings, stats = encode_bucketed(backend, texts, **bucketing)
+    return embeddings, stats["encoded_tokens"]
+
+
+def _encode_shard(texts):
+    return _encode_texts(_worker_backend, _worker_bucketing, texts)
+
+
+class EmbeddingPool:
+    """
+    チャンクのリストを複数のワーカープロセスに分割してエンコードするプール。
+
+    各ワーカーはモデルを一つずつ保持する。同時に投入するシャード数を制限してメモリ使用量を抑え、
+    結果は元のチャンクの順序で返す。bucketing が有効な場合は長さ順にシャードを作り、
+    各ワーカーでもトークン数でバッチを分けてエンコードする。
+    ワーカーが異常終了した場合はプールを作り直し、そのときのエンコードは残りをこのプロセスで行う。
+    """
+
+    def __init__(self, model_name, backend_name, workers, shard_size=64, max_in_flight=None,
+                 bucketing=False, token_budget=None):
+        self.model_name = model_name
+        self.backend_name = backend_name
+        self.bucketing = bucketing
+        self.token_budget = token_budget
+        self.workers = workers
+        self.shard_size = shard_size
+        self.max_in_flight = max_in_flight or workers * 2
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                num_threads = max(1, (os.cpu_count() or 1) // self.workers)
+                # torchはforkと相性が悪いためspawnでワーカーを起動する
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.model_name, self.backend_name, num_threads, self.bucketing, self.token_budget),
+                )
+            return self._executor
+
+    def _discard_executor(self, executor):
+        """壊れたプールを破棄する。次のエンコードでは新しいプールを作る。"""
+        with self._lock:
+            if self._executor is not executor:
+                # 別のエンコードが既に作り直している
+                return
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _encode_in_process(self, texts):
+        from utils.embedding_registry import get_embedding_backend
+        backend = get_embedding_backend(self.model_name, self.backend_name)
+        bucketing = {"token_budget": self.token_budget} if self.bucketing else None
+        return _encode_texts(backend, bucketing, texts)
+
+    def encode(self, texts, stats=None):
+        """
+        :param stats: 渡された場合、トークン数・所要秒数・1秒あたりのトークン数を書き込む
+        """
+        executor = self._get_executor()
+        order = None
+        if self.bucketing:
+            # 長さの近いチャンク同士を同じシャードに入れ、最後に元の順序へ戻す
+            order = np.argsort([len(text) for text in texts], kind="stable")
+            texts = [texts[i] for i in order]
+        shards = [texts[i:i + self.shard_size] for i in range(0, len(texts), self.shard_size)]
+        results = [None] * len(shards)
+        pending = {}
+        tokens = 0
+        next_shard = 0
+        started = time.perf_counter()
+
+        try:
+            while next_shard < len(shards) or pending:
+                while next_shard < len(shards) and len(pending) < self.max_in_flight:
+                    pending[executor.submit(_encode_shard, shards[next_shard])] = next_shard
+                    next_shard += 1
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[pending[future]], shard_tokens = future.result()
+                    del pending[future]
+                    tokens += shard_tokens
+        except (BrokenProcessPool, CancelledError):
+            # ワーカーが異常終了した（メモリ不足など）場合はプールを作り直し、残りはこのプロセスでエンコードする
+            logger.warning("埋め込みプール: ワーカーが異常終了したため、残りのシャードをこのプロセスでエンコードします")
+            self._discard_executor(executor)
+            pending.clear()
+            for i, shard in enumerate(shards):
+                if results[i] is None:
+                    results[i], shard_tokens = self._encode_in_process(shard)
+                    tokens += shard_tokens
+
+        elapsed = time.perf_counter() - started
+        logger.info(
+            f"埋め込みプール: {len(texts)}チャンク / {tokens}トークン / {self.workers}ワーカー / "
+            f"{len(texts) / elapsed if elapsed else 0:.1f} チャンク/秒"
+        )
+        if stats is not None:
+            stats.update({
+                "encoded_tokens": tokens,
+                "encode_seconds": round(elapsed, 3),
+                "tokens_per_second": round(tokens / elapsed, 1) if elapsed else None,
+            })
+        if not results:
+            return np.zeros((0, 0), dtype=np.float32)
+        embeddings = np.concatenate(results)
+        if order is not None:
+            restored = np.empty_like(embeddings)
+            restored[order] = embeddings
+            embeddings = restored
+        return embeddings
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
@@ -0,0 +1,90 @@
+import logging
+import resource
+import sys
+import threading
+import time
+from utils.embedding_backend import create_backend
+
+logger = logging.getLogger(__name__)
+
+# プロセス内で共有する埋め込みバックエンド（全セッション・全ページ共通）
+_backends = {}
+_load_stats = {}
+_registry_lock = threading.Lock()
+_backend_locks = {}
+
+
+def get_rss_mb():
+    """現在の常駐メモリ(RSS)をMB単位で返す。"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # /procが無い環境ではピークRSSで代用（macOSはバイト、Linuxはキロバイト）
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024
+
+
+def _get_backend_lock(key):
+    with _registry_lock:
+        if key not in _backend_locks:
+            _backend_locks[key] = threading.Lock()
+        return _backend_locks[key]
+
+
+def get_embedding_backend(model_name, backend_name="torch"):
+    """
+    (モデル名, バックエンド名) ごとにプロセス内で一度だけモデルをロードして返す。
+
+    同じモデルを同時に要求された場合も、ロードは一回だけ行われる。
+    """
+    key = (model_name, backend_name)
+    backend = _backends.get(key)
+    if backend is not None:
+        return backend
+
+    with _get_backend_lock(key):
+        backend = _backends.get(key)
+        if backend is not None:
+            return backend
+
+        rss_before = get_rss_mb()
+        started = time.perf_counter()
+        backend = create_backend(backend_name, model_name)
+        load_seconds = time.perf_counter() - started
+        rss_after = get_rss_mb()
+
+        _load_stats[backend.model_id] = {
+            "load_seconds": round(load_seconds, 3),
+            "rss_before_mb": round(rss_before, 1),
+            "rss_after_mb": round(rss_after, 1),
+            "rss_delta_mb": round(rss_after - rss_before, 1),
+        }
+        _backends[key] = backend
+        logger.info(f"埋め込みモデルをロードしました: {backend.model_id} {_load_stats[backend.model_id]}")
+        return backend
+
+
+def warm_up_in_background(model_name, backend_name="torch"):
+    """サーバー起動時に呼び出し、別スレッドでモデルを事前ロードする。"""
+    def _warm_up():
+        try:
+            get_embedding_backend(model_name, backend_name)
+        except Exception as e:
+            logger.warning(f"埋め込みモデルの事前ロードに失敗しました: {model_name}:{backend_name} {e}")
+
+    thread = threading.Thread(target=_warm_up, name="embedding-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def get_registry_stats():
+    """ロード済みモデルごとのロード時間とメモリ使用量を返す。"""
+    return {
+        "loaded_models": [backend.model_id for backend in _backends.values()],
+        "models": dict(_load_stats),
+        "current_rss_mb": round(get_rss_mb(), 1),
+    }
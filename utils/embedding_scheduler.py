@@ -0,0 +1,100 @@
+import logging
+import os
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 1トークンあたりに見込む推論中の中間バッファ（アテンション・FFNの活性化）のバイト数
+_BYTES_PER_TOKEN = 64 * 1024
+# 1コアあたりのバッチのトークン数（これ以上大きくしてもCPUでは速くならない）
+_TOKENS_PER_CORE = 2048
+_MIN_TOKEN_BUDGET = 1024
+
+
+def get_available_memory_mb():
+    """利用可能なメモリ(MemAvailable)をMB単位で返す。取得できない場合はNoneを返す。"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def default_token_budget(cores=None):
+    """
+    1バッチに詰めるトークン数（パディングを含む）の上限を、コア数と利用可能メモリから決める。
+
+    :param cores: 使えるコア数。Noneの場合はホストのコア数
+    """
+    cores = cores or os.cpu_count() or 1
+    budget = cores * _TOKENS_PER_CORE
+    available_mb = get_available_memory_mb()
+    if available_mb is not None:
+        # 利用可能メモリの1/8までに抑える
+        budget = min(budget, int(available_mb * 1024 * 1024 / 8 / _BYTES_PER_TOKEN))
+    return max(_MIN_TOKEN_BUDGET, budget)
+
+
+def plan_batches(lengths, token_budget, max_batch_size=256):
+    """
+    トークン数の昇順に並べたインデックスを、パディング後のトークン数が token_budget 以内のバッチに分ける。
+
+    同じバッチには長さの近いテキストだけが入るため、短いチャンクが長いチャンクに合わせて
+    パディングされることがなく、短いチャンクほど大きなバッチでまとめてエンコードされる。
+
+    :param lengths: 各テキストのトークン数
+    :return: 元のインデックスのリストのリスト
+    """
+    order = np.argsort(lengths, kind="stable")
+    batches = []
+    batch = []
+    for index in order:
+        # 昇順なので、追加するテキストの長さがバッチ内の最大長になる
+        padded_tokens = (len(batch) + 1) * max(lengths[index], 1)
+        if batch and (padded_tokens > token_budget or len(batch) >= max_batch_size):
+            batches.append(batch)
+            batch = []
+        batch.append(int(index))
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def encode_bucketed(backend, texts, token_budget=None, max_batch_size=256):
+    """
+    テキストをトークン数でバケットに分けてエンコードし、元の順序の埋め込み行列を返す。
+
+    :param backend: EmbeddingBackend
+    :param token_budget: 1バッチのトークン数の上限。Noneの場合はコア数と利用可能メモリから決める
+    :return: (埋め込み行列, 統計情報の辞書（トークン数、バッチ数、所要秒数、1秒あたりのトークン数）)
+    """
+    texts = list(texts)
+    token_budget = token_budget or default_token_budget()
+    started = time.perf_counter()
+    lengths = backend.count_tokens(texts)
+
+    embeddings = None
+    batches = plan_batches(lengths, token_budget, max_batch_size)
+    for batch in batches:
+        vectors = backend.encode([texts[i] for i in batch], batch_size=len(batch))
+        if embeddings is None:
+            embeddings = np.zeros((len(texts), vectors.shape[1]), dtype=np.float32)
+        # 元の順序の位置に書き戻す
+        embeddings[batch] = vectors
+
+    elapsed = time.perf_counter() - started
+    tokens = int(sum(lengths))
+    stats = {
+        "encoded_tokens": tokens,
+        "batches": len(batches),
+        "encode_seconds": round(elapsed, 3),
+        "tokens_per_second": round(tokens / elapsed, 1) if elapsed else None,
+    }
+    logger.info(f"バケット化エンコード: {len(texts)}チャンク / {stats}（上限 {token_budget}トークン/バッチ）")
+    if embeddings is None:
+        embeddings = np.zeros((0, 0), dtype=np.float32)
+    return embeddings, stats
@@ -0,0 +1,243 @@
+import codecs
+import logging
+import re
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+import requests
+from requests.adapters import HTTPAdapter
+from utils.url_policy import UnsafeUrlError, ensure_public_url
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "Mozilla/5.0 (compatible; SAKIYOMI-Intelligence/1.0)"
+
+# 本文として扱わない要素
+SKIPPED_TAGS = {"script", "style", "noscript", "template", "svg", "iframe", "nav", "header", "footer", "aside", "form", "button"}
+# 改行で区切るブロック要素
+BLOCK_TAGS = {
+    "p", "div", "section", "article", "main", "li", "ul", "ol", "br", "tr", "table", "blockquote", "pre",
+    "h1", "h2", "h3", "h4", "h5", "h6", "dd", "dt", "figcaption",
+}
+# 要素を閉じる必要がない要素（終了タグが来ないため深さを数えない）
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+# 本文が入っている可能性が高い要素
+CONTENT_TAGS = ("article", "main")
+
+
+class _ContentExtractor(HTMLParser):
+    """タイトル・メタ情報と、要素ごとの本文テキストを一度の走査で取り出すパーサー。"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ""
+        self.meta = {}
+        self.body_parts = []
+        self.content_parts = {tag: [] for tag in CONTENT_TAGS}
+        self._in_title = False
+        self._skip_depth = 0
+        self._content_depth = {tag: 0 for tag in CONTENT_TAGS}
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "meta":
+            attrs = dict(attrs)
+            name = (attrs.get("name") or attrs.get("property") or "").lower()
+            if name and attrs.get("content"):
+                self.meta.setdefault(name, attrs["content"])
+            return
+        if tag in VOID_TAGS:
+            if tag == "br":
+                self._append("\n")
+            return
+        if tag == "title":
+            self._in_title = True
+        if tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+        if tag in self._content_depth:
+            self._content_depth[tag] += 1
+        if tag in BLOCK_TAGS:
+            self._append("\n")
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+        if tag in SKIPPED_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        if tag in self._content_depth and self._content_depth[tag]:
+            self._content_depth[tag] -= 1
+        if tag in BLOCK_TAGS:
+            self._append("\n")
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+            return
+        if self._skip_depth:
+            return
+        self._append(data)
+
+    def _append(self, text):
+        self.body_parts.append(text)
+        for tag, depth in self._content_depth.items():
+            if depth:
+                self.content_parts[tag].append(text)
+
+
+def _clean_text(parts):
+    lines = (" ".join(line.split()) for line in "".join(parts).splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def extract_main_content(html):
+    """
+    HTMLから本文を取り出す。article/main要素があればその中身を、無ければbody全体を本文とする。
+
+    :return: (本文, タイトル, メタ情報の辞書)
+    """
+    parser = _ContentExtractor()
+    parser.feed(html)
+    parser.close()
+
+    body_text = _clean_text(parser.body_parts)
+    text = body_text
+    for tag in CONTENT_TAGS:
+        content_text = _clean_text(parser.content_parts[tag])
+        # 本文の大半を含んでいる場合のみ採用する（小さなarticle要素だけを拾わないように）
+        if len(content_text) >= len(body_text) * 0.3:
+            text = content_text
+            break
+    return text, " ".join(parser.title.split()), parser.meta
+
+
+# <meta charset="..."> と <meta http-equiv="Content-Type" content="...; charset=..."> の両方に一致する
+_META_CHARSET_PATTERN = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([A-Za-z0-9_.:-]+)""", re.IGNORECASE)
+# 文字コードの指定が無い日本語サイトでよく使われる文字コード（UTF-8として読めなかった場合に順に試す）
+_FALLBACK_ENCODINGS = ("cp932", "euc_jp")
+
+
+def _normalize_encoding(encoding):
+    """Pythonのコーデック名を返す。未知の文字コードの場合はNoneを返す。"""
+    try:
+        name = codecs.lookup(encoding).name
+    except LookupError:
+        return None
+    # ブラウザと同じく、Shift_JISの指定はWindowsの拡張文字（①や～など）を含むcp932として読む
+    return "cp932" if name == "shift_jis" else name
+
+
+def detect_encoding(content, declared=None):
+    """
+    HTMLのバイト列の文字コードを決める。
+
+    Content-Typeヘッダーの指定、<meta charset>、UTF-8として読めるか、charset_normalizerによる推定、
+    日本語の代表的な文字コードの順に試す。
+
+    :param declared: Content-Typeヘッダーで指定された文字コード（requestsは指定が無いとISO-8859-1を返す）
+    """
+    if declared and declared.lower() != "iso-8859-1" and _normalize_encoding(declared):
+        return _normalize_encoding(declared)
+    match = _META_CHARSET_PATTERN.search(content[:4096])
+    if match and _normalize_encoding(match.group(1).decode("ascii")):
+        return _normalize_encoding(match.group(1).decode("ascii"))
+    try:
+        content.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    try:
+        from charset_normalizer import from_bytes
+        best = from_bytes(content).best()
+        if best is not None:
+            return best.encoding
+    except ImportError:
+        pass
+    for encoding in _FALLBACK_ENCODINGS:
+        try:
+            content.decode(encoding)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return "utf-8"
+
+
+class GuardedSession:
+    """
+    内部ネットワークのアドレスにはリクエストを送らない、接続を使い回すHTTPセッション。
+
+    サーバーから利用者が入力したURLを取得するリクエストはすべてこのセッションを通す。
+    リダイレクトは自前でたどり、最初のリクエストとリダイレクト先ごとにホストのアドレスを確かめる。
+    許可しないアドレスの場合は UnsafeUrlError を送出する。
+    """
+
+    def __init__(self, pool_size=20, max_redirects=5):
+        self.max_redirects = max_redirects
+        self._session = requests.Session()
+        self._session.headers.update({"User-Agent": USER_AGENT, "Accept-Language": "ja,en;q=0.8"})
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def request(self, method, url, allow_redirects=True, **kwargs):
+        for _ in range(self.max_redirects + 1):
+            ensure_public_url(url)
+            response = self._session.request(method, url, allow_redirects=False, **kwargs)
+            if not allow_redirects or not response.is_redirect:
+                return response
+            url = urljoin(response.url, response.headers["Location"])
+            response.close()
+        raise requests.TooManyRedirects(f"リダイレクトが{self.max_redirects}回を超えました: {url}")
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+
+class HttpFetcher:
+    """
+    接続を使い回すHTTPセッションで静的なページを取得し、本文を抽出する。
+
+    結果は extract_keys_from_json が受け取るApifyのアイテムと同じ形で返す。
+    JavaScriptで描画されるページや内部ネットワークのURLなど、本文を取れない場合はNoneを返す（呼び出し元はApifyを使う）。
+    """
+
+    def __init__(self, timeout=3.0, min_text_chars=200, max_bytes=5 * 1024 * 1024, session=None):
+        self.timeout = timeout
+        self.min_text_chars = min_text_chars
+        self.max_bytes = max_bytes
+        self.session = session or GuardedSession()
+
+    def fetch(self, url):
+        try:
+            with self.session.get(url, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                if "html" not in response.headers.get("Content-Type", ""):
+                    return None
+                content = response.raw.read(self.max_bytes + 1, decode_content=True)
+        except UnsafeUrlError as e:
+            logger.warning(f"内部ネットワークのURLのためHTTPでは取得しません: {e}")
+            return None
+        except Exception as e:
+            logger.info(f"HTTPでの取得に失敗しました: {url} {e}")
+            return None
+        if len(content) > self.max_bytes:
+            return None
+
+        # 日本語サイトは文字コードの指定が無いことがあるため、その場合は読み込んだバイト列から推定する
+        # （本文はresponse.rawから読んでいるため、response.apparent_encodingは使えない）
+        html = content.decode(detect_encoding(content, response.encoding), errors="replace")
+
+        text, title, meta = extract_main_content(html)
+        if len(re.sub(r"\s", "", text)) < self.min_text_chars:
+            # 本文がほとんど無い場合はJavaScriptで描画されるページとみなす
+            return None
+
+        return {
+            "url": response.url,
+            "text": text,
+            "metadata": {
+                "title": meta.get("og:title") or title,
+                "description": meta.get("description") or meta.get("og:description", ""),
+                "keywords": meta.get("keywords", ""),
+            },
+        }
@@ -0,0 +1,228 @@
+import logging
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# ワーカープロセスごとに、直前に開いたPDFのリーダーを保持する（同じPDFのページ範囲が続けて届くため）
+_worker_reader = None
+
+
+class _PageTimeout(Exception):
+    pass
+
+
+def _raise_page_timeout(signum, frame):
+    raise _PageTimeout()
+
+
+def _open_reader(path):
+    global _worker_reader
+    # 一時ファイルのパスは再利用されうるため、更新時刻も合わせて比較する
+    key = (path, os.stat(path).st_mtime_ns)
+    if _worker_reader is None or _worker_reader[0] != key:
+        from PyPDF2 import PdfReader
+        _worker_reader = (key, PdfReader(path))
+    return _worker_reader[1]
+
+
+def _extract_page_range(path, start, end, page_timeout):
+    """
+    ワーカープロセスで start〜end-1 ページのテキストを抽出する。
+
+    1ページの抽出が page_timeout 秒を超えた場合はそのページを空として扱う。
+
+    :return: (ページのテキストのリスト, タイムアウトしたページ番号のリスト)
+    """
+    return _read_pages(_open_reader(path), start, end, page_timeout)
+
+
+def _read_pages(reader, start, end, page_timeout):
+    # SIGALRMはUnixのメインスレッドのみ。使えない環境ではタイムアウトなしで抽出する
+    use_alarm = page_timeout and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_page_timeout)
+
+    texts = []
+    timed_out = []
+    for page_number in range(start, end):
+        try:
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, page_timeout)
+            text = reader.pages[page_number].extract_text() or ""
+        except _PageTimeout:
+            text = ""
+            timed_out.append(page_number)
+        finally:
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        texts.append(text + "\n")
+    return texts, timed_out
+
+
+class _PoolStalled(Exception):
+    pass
+
+
+class PdfExtractionPool:
+    """
+    PDFのページ範囲を複数のワーカープロセスに分割してテキストを抽出するプール。
+
+    同時に投入するページ範囲の数を制限し、抽出できたページからページ順に返す。
+    ワーカー内のタイムアウトが効かずに task_deadline 秒を超えて戻らないページ範囲は空のページとして扱う。
+    その場合やワーカーが異常終了した場合はプールを作り直し、残りのページ範囲はこのプロセスで抽出する。
+
+    :param task_margin: ページ範囲の待ち時間の上限(pages_per_task * page_timeout)に加える余裕の秒数
+    """
+
+    def __init__(self, workers, pages_per_task=8, page_timeout=20.0, max_in_flight=None, task_margin=30.0):
+        self.workers = workers
+        self.pages_per_task = pages_per_task
+        self.page_timeout = page_timeout
+        self.max_in_flight = max_in_flight or workers * 2
+        self.task_deadline = pages_per_task * page_timeout + task_margin if page_timeout else None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Streamlitのスレッドを抱えたままforkしないようspawnでワーカーを起動する
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def _discard_executor(self, executor):
+        """止まった・壊れたプールを破棄する。次の抽出では新しいプールを作る。"""
+        with self._lock:
+            if self._executor is not executor:
+                # 別の抽出が既に作り直している
+                return
+            self._executor = None
+        # 戻ってこないワーカーは終わるのを待たずに終了させる
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _wait_timeout(self, running_since):
+        if self.task_deadline is None:
+            return None
+        # 実行中になった時刻を確かめるため、長くても1秒ごとに起きる
+        now = time.monotonic()
+        remaining = [since + self.task_deadline - now for since in running_since.values() if since is not None]
+        return max(0.0, min(remaining + [1.0]))
+
+    def iter_pages(self, pdf_bytes, total_pages, stats=None):
+        """
+        ページのテキストを1ページずつページ順に返す（各ページの末尾に改行を付ける）。
+
+        :param pdf_bytes: PDFファイルの中身
+        :param total_pages: PDFの全ページ数
+        :param stats: 渡された場合、抽出秒数・1秒あたりのページ数・タイムアウトしたページ番号を書き込む
+        """
+        ranges = [
+            (start, min(start + self.pages_per_task, total_pages))
+            for start in range(0, total_pages, self.pages_per_task)
+        ]
+        # ワーカーにはPDFの中身ではなく一時ファイルのパスを渡す
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+            f.write(pdf_bytes)
+            path = f.name
+
+        results = {}
+        # future -> ページ範囲の番号
+        pending = {}
+        # future -> ワーカーで実行中になったのを確認した時刻
+        running_since = {}
+        timed_out = []
+        next_range = 0
+        next_to_yield = 0
+        local_reader = None
+        started = time.perf_counter()
+        try:
+            while next_to_yield < len(ranges):
+                if local_reader is not None:
+                    # プールを使えなくなった後は、このプロセスで1範囲ずつ抽出する
+                    if next_to_yield not in results:
+                        start, end = ranges[next_to_yield]
+                        results[next_to_yield] = _read_pages(local_reader, start, end, None)[0]
+                else:
+                    executor = self._get_executor()
+                    try:
+                        while next_range < len(ranges) and len(pending) < self.max_in_flight:
+                            start, end = ranges[next_range]
+                            future = executor.submit(_extract_page_range, path, start, end, self.page_timeout)
+                            pending[future] = next_range
+                            running_since[future] = None
+                            next_range += 1
+                        done, _ = wait(pending, timeout=self._wait_timeout(running_since), return_when=FIRST_COMPLETED)
+                        for future in done:
+                            texts, range_timed_out = future.result()
+                            results[pending.pop(future)] = texts
+                            running_since.pop(future)
+                            timed_out.extend(range_timed_out)
+                        self._check_deadlines(ranges, pending, running_since, results, timed_out)
+                    except (BrokenProcessPool, CancelledError, _PoolStalled) as e:
+                        reason = "応答しない" if isinstance(e, _PoolStalled) else "異常終了した"
+                        logger.warning(f"PDF抽出: ワーカーが{reason}ため、残りのページをこのプロセスで抽出します")
+                        self._discard_executor(executor)
+                        pending.clear()
+                        running_since.clear()
+                        from PyPDF2 import PdfReader
+                        local_reader = PdfReader(path)
+                # 先頭から揃ったページ範囲だけを返す
+                while next_to_yield in results:
+                    yield from results.pop(next_to_yield)
+                    next_to_yield += 1
+        finally:
+            for future in pending:
+                future.cancel()
+            os.unlink(path)
+
+        elapsed = time.perf_counter() - started
+        pages_per_second = round(total_pages / elapsed, 1) if elapsed else None
+        if timed_out:
+            logger.warning(f"PDF抽出: {len(timed_out)}ページがタイムアウトしたため空として扱いました: {sorted(timed_out)}")
+        logger.info(f"PDF抽出プール: {total_pages}ページ / {self.workers}ワーカー / {pages_per_second} ページ/秒")
+        if stats is not None:
+            stats.update({
+                "extract_seconds": round(elapsed, 3),
+                "pages_per_second": pages_per_second,
+                "timed_out_pages": sorted(timed_out),
+            })
+
+    def _check_deadlines(self, ranges, pending, running_since, results, timed_out):
+        """task_deadline 秒を超えて実行中のページ範囲を空のページとして扱い、_PoolStalled を送出する。"""
+        if self.task_deadline is None:
+            return
+        now = time.monotonic()
+        stalled = False
+        for future, index in list(pending.items()):
+            if running_since[future] is None:
+                if future.running():
+                    running_since[future] = now
+                continue
+            if now - running_since[future] < self.task_deadline:
+                continue
+            start, end = ranges[index]
+            results[index] = ["\n"] * (end - start)
+            timed_out.extend(range(start, end))
+            del pending[future]
+            del running_since[future]
+            stalled = True
+        if stalled:
+            raise _PoolStalled()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
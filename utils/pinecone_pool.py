@@ -0,0 +1,91 @@
+import hashlib
+import logging
+import threading
+import time
+from pinecone import Pinecone
+
+logger = logging.getLogger(__name__)
+
+
+def api_key_hash(api_key):
+    """APIキーを識別するための短いハッシュ。APIキーそのものは統計情報やローカルのストアに残さない。"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+class PineconeClientPool:
+    """
+    (APIキー, インデックス名) ごとにPineconeのクライアントとIndexを使い回すプール。
+
+    Streamlitの再実行やセッションをまたいでkeep-alive接続を共有し、
+    一定時間使われなかったものは破棄する。
+    """
+
+    def __init__(self, idle_seconds=1800):
+        self.idle_seconds = idle_seconds
+        self._clients = {}
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key_hash(api_key):
+        return api_key_hash(api_key)
+
+    def get_index(self, api_key, index_name):
+        key = (self._key_hash(api_key), index_name)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._indexes.get(key)
+            if entry is not None:
+                entry["last_used"] = now
+                self.hits += 1
+                return entry["index"]
+
+            self.misses += 1
+            client_entry = self._clients.get(key[0])
+            if client_entry is None:
+                client_entry = {"client": Pinecone(api_key=api_key), "last_used": now}
+                self._clients[key[0]] = client_entry
+            client_entry["last_used"] = now
+
+            index = client_entry["client"].Index(index_name)
+            self._indexes[key] = {"index": index, "created_at": now, "last_used": now}
+            return index
+
+    def _evict_idle(self, now):
+        for key, entry in list(self._indexes.items()):
+            if now - entry["last_used"] > self.idle_seconds:
+                del self._indexes[key]
+                self.evictions += 1
+                close = getattr(entry["index"], "close", None)
+                if close is not None:
+                    try:
+                        close()
+                    except Exception as e:
+                        logger.warning(f"Pineconeの接続を閉じられませんでした: {e}")
+        in_use = {key[0] for key in self._indexes}
+        for key_hash, entry in list(self._clients.items()):
+            if key_hash not in in_use and now - entry["last_used"] > self.idle_seconds:
+                del self._clients[key_hash]
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "indexes": [
+                    {
+                        "api_key": key[0],
+                        "index_name": key[1],
+                        "age_seconds": round(now - entry["created_at"]),
+                        "idle_seconds": round(now - entry["last_used"]),
+                    }
+                    for key, entry in self._indexes.items()
+                ],
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,110 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text):
+    """NFKC正規化し、前後の空白と連続する空白をまとめたクエリ文字列を返す。"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class QueryEmbeddingCache:
+    """
+    (モデル名, 正規化済みクエリ) をキーにしたクエリ埋め込みのキャッシュ。
+
+    メモリ上のLRUと、任意でSQLiteによるディスク層を持つ。ディスク層はサーバー再起動後も残る。
+    """
+
+    def __init__(self, max_entries=1024, disk_path=None):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                "PRIMARY KEY (model, text_hash))"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def _make_key(model_name, text):
+        text_hash = hashlib.sha256(normalize_query(text).encode("utf-8")).hexdigest()
+        return model_name, text_hash
+
+    def get(self, model_name, text):
+        key = self._make_key(model_name, text)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return embedding
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT vector FROM query_embeddings WHERE model = ? AND text_hash = ?", key
+                ).fetchone()
+                if row is not None:
+                    embedding = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, embedding)
+                    self.disk_hits += 1
+                    return embedding
+
+            self.misses += 1
+            return None
+
+    def put(self, model_name, text, embedding):
+        key = self._make_key(model_name, text)
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._remember(key, embedding)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                    (key[0], key[1], embedding.tobytes()),
+                )
+                self._db.commit()
+        return embedding
+
+    def get_or_compute(self, model_name, text, compute):
+        """キャッシュに無い場合のみ compute(text) を呼び出して埋め込みを作る。"""
+        embedding = self.get(model_name, text)
+        if embedding is None:
+            embedding = self.put(model_name, text, compute(text))
+        return embedding
+
+    def _remember(self, key, embedding):
+        # 呼び出し側でキャッシュ内のベクトルを書き換えられないようにする
+        embedding.setflags(write=False)
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "disk_enabled": self._db is not None,
+            }
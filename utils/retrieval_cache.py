@@ -0,0 +1,142 @@
+import copy
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from utils.vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+
+class RetrievalCache:
+    """
+    (インデックス, ネームスペース, クエリ埋め込みのハッシュ, top_k) をキーにした検索結果のキャッシュ。
+
+    ネームスペースごとの書き込み世代を持ち、書き込み・削除のたびに世代を進めることで
+    そのネームスペースの古い検索結果を無効にする。インデックスには VectorStore.scope_name
+    （APIキーのハッシュとインデックス名）を渡し、同じインデックス名の別テナントと共有しないようにする。
+    """
+
+    def __init__(self, max_entries=2048, ttl_seconds=600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def generation(self, index_name, namespace):
+        return self._generations.get((index_name, namespace), 0)
+
+    def bump(self, index_name, namespace):
+        """ネームスペースへの書き込み後に呼び出し、そのネームスペースのキャッシュを無効にする。"""
+        with self._lock:
+            key = (index_name, namespace)
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    @staticmethod
+    def make_key(index_name, namespace, vector, top_k, include_metadata=True, filter=None):
+        vector_hash = hashlib.sha256(np.asarray(vector, dtype=np.float32).tobytes()).hexdigest()
+        filter_key = json.dumps(filter, sort_keys=True, ensure_ascii=False) if filter else ""
+        return (index_name, namespace, vector_hash, top_k, include_metadata, filter_key)
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if (
+                entry is None
+                or entry["generation"] != self.generation(key[0], key[1])
+                or now - entry["stored_at"] > self.ttl_seconds
+            ):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            # 呼び出し側で結果を書き換えてもキャッシュに影響しないようにコピーを返す
+            return copy.deepcopy(entry["results"])
+
+    def put(self, key, results, generation):
+        """
+        検索結果を保存する。
+
+        :param generation: 検索を始める前に generation() で取得した世代。
+            検索中に書き込みがあった場合、結果は古い世代として保存され、次の get() で無効になる
+        """
+        with self._lock:
+            self._entries[key] = {
+                "results": copy.deepcopy(results),
+                "generation": generation,
+                "stored_at": time.monotonic(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "entries": len(self._entries),
+                "generations": {f"{index}/{ns}": gen for (index, ns), gen in self._generations.items()},
+            }
+
+
+class CachedVectorStore(VectorStore):
+    """検索結果をRetrievalCacheにキャッシュし、書き込み・削除のたびに世代を進めるVectorStore。"""
+
+    def __init__(self, inner, cache):
+        self.inner = inner
+        self.name = inner.name
+        self.tenant = inner.tenant
+        self.cache = cache
+
+    def query(self, vector, top_k, namespace, include_metadata=True, filter=None):
+        key = self.cache.make_key(self.scope_name, namespace, vector, top_k, include_metadata, filter)
+        results = self.cache.get(key)
+        if results is None:
+            # 検索中の書き込みで古い結果が新しい世代として保存されないよう、世代は検索の前に読む
+            generation = self.cache.generation(self.scope_name, namespace)
+            results = self.inner.query(vector, top_k, namespace, include_metadata=include_metadata, filter=filter)
+            self.cache.put(key, results, generation)
+        return results
+
+    def upsert(self, vectors, namespace):
+        try:
+            return self.inner.upsert(vectors, namespace)
+        finally:
+            self.cache.bump(self.scope_name, namespace)
+
+    def delete(self, ids, namespace):
+        try:
+            return self.inner.delete(ids, namespace)
+        finally:
+            self.cache.bump(self.scope_name, namespace)
+
+    def delete_all(self, namespace):
+        try:
+            return self.inner.delete_all(namespace)
+        finally:
+            self.cache.bump(self.scope_name, namespace)
+
+    def fetch(self, ids, namespace):
+        return self.inner.fetch(ids, namespace)
+
+    def list_ids(self, prefix, namespace):
+        return self.inner.list_ids(prefix, namespace)
+
+    def list_namespaces(self):
+        return self.inner.list_namespaces()
+
+    def namespace_vector_count(self, namespace):
+        return self.inner.namespace_vector_count(namespace)
+
+    def flush(self):
+        return self.inner.flush()
@@ -1,12 +1,13 @@
 import requests
 import json
 import os
+import hashlib
+import io
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 import requests
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 import pinecone
 from pinecone import Pinecone
-from sentence_transformers import SentenceTransformer
 from PyPDF2 import PdfReader
 import langchain
 from openai import OpenAI, AzureOpenAI
@@ -20,7 +21,74 @@ from utils.example_prompt import system_prompt_example, system_prompt_title_recc
 import anthropic
 from apify_client import ApifyClient
 import logging
-from ng_url_list import ng_urls
+import atexit
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from config.pipeline import (
+    EMBEDDING_MODEL_NAME,
+    EMBEDDING_BACKEND,
+    EMBEDDING_WARMUP,
+    QUERY_EMBEDDING_CACHE_SIZE,
+    QUERY_EMBEDDING_CACHE_PATH,
+    CHUNK_EMBEDDING_STORE_PATH,
+    CHUNK_EMBEDDING_STORE_DTYPE,
+    CHUNK_EMBEDDING_STORE_MAX_ENTRIES,
+    EMBEDDING_POOL_WORKERS,
+    EMBEDDING_POOL_SHARD_SIZE,
+    EMBEDDING_POOL_MIN_CHUNKS,
+    EMBEDDING_BUCKETING,
+    EMBEDDING_BATCH_TOKEN_BUDGET,
+    NAMESPACE_QUERY_TIMEOUT,
+    NAMESPACE_QUERY_WORKERS,
+    VECTOR_STORE_BACKEND,
+    VECTOR_STORE_NUMPY_DIR,
+    UPSERT_BATCH_MAX_VECTORS,
+    UPSERT_BATCH_MAX_BYTES,
+    UPSERT_MAX_WORKERS,
+    UPSERT_MAX_RETRIES,
+    PINECONE_POOL_IDLE_SECONDS,
+    SLIM_VECTOR_METADATA,
+    CHUNK_TEXT_STORE_PATH,
+    RETRIEVAL_CACHE_SIZE,
+    RETRIEVAL_CACHE_TTL_SECONDS,
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_NAMESPACE_WEIGHTS,
+    SCRAPE_CACHE_DIR,
+    SCRAPE_CACHE_TTL_SECONDS,
+    SCRAPE_CACHE_MAX_BYTES,
+    SCRAPE_STREAM_PAGE_SIZE,
+    SCRAPE_POLL_INTERVAL_SECONDS,
+    READINESS_MAX_WAIT_SECONDS,
+    HTTP_FAST_PATH,
+    HTTP_FAST_PATH_TIMEOUT_SECONDS,
+    HTTP_FAST_PATH_MIN_TEXT_CHARS,
+    URL_RESOLVE_REDIRECTS,
+    NG_URL_RELOAD_SECONDS,
+    PDF_STREAM_BATCH_SIZE,
+    PDF_EXTRACT_WORKERS,
+    PDF_EXTRACT_PAGES_PER_TASK,
+    PDF_EXTRACT_PAGE_TIMEOUT_SECONDS,
+    PDF_EXTRACT_MIN_PAGES,
+    PDF_TEXT_CACHE_DIR,
+    PDF_TEXT_CACHE_MAX_BYTES,
+    TEXT_SPLITTER,
+)
+from utils.embedding_registry import get_embedding_backend, warm_up_in_background
+from utils.query_embedding_cache import QueryEmbeddingCache
+from utils.chunk_embedding_store import ChunkEmbeddingStore
+from utils.embedding_pool import EmbeddingPool
+from utils.embedding_scheduler import encode_bucketed
+from utils.vector_store import NumpyVectorStore, PineconeVectorStore, as_vector_store
+from utils.upsert_pipeline import upsert_in_batches
+from utils.pinecone_pool import PineconeClientPool, api_key_hash
+from utils.chunk_text_store import ChunkTextStore, SlimMetadataVectorStore
+from utils.retrieval_cache import CachedVectorStore, RetrievalCache
+from utils.context_packer import count_tokens, pack_context
+from utils.disk_cache import CompressedDiskCache
+from utils.http_fetcher import GuardedSession, HttpFetcher
+from utils.url_policy import NgUrlMatcher, RedirectResolver, canonicalize_url
+from utils.pdf_extract_pool import PdfExtractionPool
+from utils.text_splitter import JapaneseTextSplitter
 
 # ロガーを設定
 logger = logging.getLogger(__name__)
@@ -34,24 +102,225 @@ apify_wcc_endpoint = st.secrets['website_content_crawler_endpoint']
 apifyapi_key = st.secrets['apifyapi_key']
 openai_api_key = st.secrets['OPENAI_API_KEY']
 
+# モジュールはプロセスごとに一度だけimportされるため、ここでモデルの事前ロードを開始する
+if EMBEDDING_WARMUP:
+    warm_up_in_background(EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND)
+
+# 全セッションで共有するクエリ埋め込みキャッシュ
+query_embedding_cache = QueryEmbeddingCache(
+    max_entries=QUERY_EMBEDDING_CACHE_SIZE,
+    disk_path=QUERY_EMBEDDING_CACHE_PATH or None,
+)
+
+# 再登録されたURL・PDFのチャンク埋め込みを再利用するためのストア
+chunk_embedding_store = None
+if CHUNK_EMBEDDING_STORE_PATH:
+    chunk_embedding_store = ChunkEmbeddingStore(
+        CHUNK_EMBEDDING_STORE_PATH,
+        dtype=CHUNK_EMBEDDING_STORE_DTYPE,
+        max_entries=CHUNK_EMBEDDING_STORE_MAX_ENTRIES,
+    )
+
+# 大きなドキュメントの登録時に使うマルチプロセス埋め込みプール（オプトイン）
+embedding_pool = None
+if EMBEDDING_POOL_WORKERS > 0:
+    embedding_pool = EmbeddingPool(
+        EMBEDDING_MODEL_NAME,
+        EMBEDDING_BACKEND,
+        workers=EMBEDDING_POOL_WORKERS,
+        shard_size=EMBEDDING_POOL_SHARD_SIZE,
+        bucketing=EMBEDDING_BUCKETING,
+        token_budget=EMBEDDING_BATCH_TOKEN_BUDGET or None,
+    )
+    atexit.register(embedding_pool.shutdown)
+
+# ページ数の多いPDFのテキスト抽出に使うマルチプロセスプール（オプトイン）
+pdf_extraction_pool = None
+if PDF_EXTRACT_WORKERS > 0:
+    pdf_extraction_pool = PdfExtractionPool(
+        workers=PDF_EXTRACT_WORKERS,
+        pages_per_task=PDF_EXTRACT_PAGES_PER_TASK,
+        page_timeout=PDF_EXTRACT_PAGE_TIMEOUT_SECONDS,
+    )
+    atexit.register(pdf_extraction_pool.shutdown)
+
+# 再実行・セッションをまたいで共有するPineconeの接続プール
+pinecone_pool = PineconeClientPool(idle_seconds=PINECONE_POOL_IDLE_SECONDS)
+
+# インデックスに載せないチャンク本文などを保存するローカルストア（オプトイン）
+chunk_text_store = ChunkTextStore(CHUNK_TEXT_STORE_PATH) if SLIM_VECTOR_METADATA else None
+
+# 検索結果のキャッシュ（書き込み・削除のたびにネームスペース単位で無効化される）
+retrieval_cache = None
+if RETRIEVAL_CACHE_SIZE > 0:
+    retrieval_cache = RetrievalCache(max_entries=RETRIEVAL_CACHE_SIZE, ttl_seconds=RETRIEVAL_CACHE_TTL_SECONDS)
+
+# スクレイピング結果のキャッシュ（セッション・ユーザーをまたいで共有する）
+scrape_cache = None
+if SCRAPE_CACHE_DIR:
+    scrape_cache = CompressedDiskCache(SCRAPE_CACHE_DIR, ttl_seconds=SCRAPE_CACHE_TTL_SECONDS, max_bytes=SCRAPE_CACHE_MAX_BYTES)
+
+# PDFから抽出したページのテキストのキャッシュ（同じファイルの再アップロード時に抽出を省く）
+pdf_text_cache = None
+if PDF_TEXT_CACHE_DIR:
+    pdf_text_cache = CompressedDiskCache(PDF_TEXT_CACHE_DIR, max_bytes=PDF_TEXT_CACHE_MAX_BYTES)
+
+# サーバーから直接URLを取得するリクエスト（本文・リダイレクト先・サイトマップ）はすべてこのセッションを通し、
+# 内部ネットワークのアドレスへのリクエストを拒否する（接続は全セッションで共有する）
+http_session = GuardedSession()
+
+# 静的なページをApifyを使わずに取得するためのHTTPクライアント
+http_fetcher = None
+if HTTP_FAST_PATH:
+    http_fetcher = HttpFetcher(
+        timeout=HTTP_FAST_PATH_TIMEOUT_SECONDS, min_text_chars=HTTP_FAST_PATH_MIN_TEXT_CHARS, session=http_session
+    )
+
+# NG URLの判定（ng_url_list.py と secretsの NG_URL_PATTERNS を定期的に読み込み直す）
+ng_url_matcher = NgUrlMatcher(
+    extra_patterns=lambda: st.secrets.get("NG_URL_PATTERNS", []),
+    reload_interval=NG_URL_RELOAD_SECONDS,
+)
+
+# リダイレクト先の解決結果を覚えておき、同じページへの重複したスクレイピングを防ぐ
+redirect_resolver = None
+if URL_RESOLVE_REDIRECTS:
+    redirect_resolver = RedirectResolver(http_session)
+
+# ネームスペース検索を並列に投げるためのスレッドプール（全セッション共通）
+namespace_query_executor = ThreadPoolExecutor(max_workers=NAMESPACE_QUERY_WORKERS, thread_name_prefix="ns-query")
+
 #NG URLを判別する関数
 def is_ng_url(url):
-    return any(ng_url in url for ng_url in ng_urls)
+    return ng_url_matcher.is_ng(url)
+
+def normalize_url(url):
+    """正規化し、設定されていればリダイレクト先に解決したURLを返す。キャッシュのキーにだけ使い、取得には使わない。"""
+    if redirect_resolver is not None:
+        return redirect_resolver.resolve(url)
+    return canonicalize_url(url)
 
 # URLからコンテンツをスクレイピングする関数
-def scrape_url(url):
-    apify_client = ApifyClient(st.secrets["apifyapi_key"])
+def scrape_url(url, force_refresh=False):
+    url = url.strip()
+    cache_key = f"apify-wcc:{normalize_url(url)}"
+    if scrape_cache is not None and not force_refresh:
+        cached_items = scrape_cache.get(cache_key)
+        if cached_items is not None:
+            logger.info(f"スクレイピング結果をキャッシュから取得しました: {url}")
+            return cached_items
+
+    # 静的なページはHTTPで直接取得し、取得できない場合のみApifyを使う
+    dataset_items = _scrape_url_fast_path(url) or _scrape_url_with_apify(url)
+
+    # 空の結果は一時的な失敗の可能性があるためキャッシュしない
+    if scrape_cache is not None and dataset_items:
+        scrape_cache.put(cache_key, dataset_items)
+    return dataset_items
+
+def _scrape_url_fast_path(url):
+    """HTTPで直接取得して本文を抽出する。取得できない・本文が短い場合はNoneを返す。"""
+    if http_fetcher is None:
+        return None
+    started = time.perf_counter()
+    item = http_fetcher.fetch(url)
+    if item is None:
+        logger.info(f"HTTPで本文を取得できなかったためApifyを使います: {url}")
+        return None
+    logger.info(f"HTTPで本文を取得しました（{time.perf_counter() - started:.2f}秒）: {url}")
+    return [item]
+
+def _wcc_run_input(url):
+    return {
+        'startUrls': [{'url': url}],
+        'maxRequestsPerCrawl': 3,
+        'maxCrawlingDepth': 3,
+    }
+
+def _scrape_url_with_apify(url):
+    apify_client = ApifyClient(apifyapi_key)
     actor_call = apify_client.actor('apify/website-content-crawler').call(
-        run_input={
-            'startUrls': [{'url': url}],
-            'maxRequestsPerCrawl': 3,
-            'maxCrawlingDepth': 3,
-        },
+        run_input=_wcc_run_input(url),
         timeout_secs=120
     )
     dataset_items = apify_client.dataset(actor_call['defaultDatasetId']).list_items().items
     return list(dataset_items)
 
+# アクターの実行が終了したことを表すステータス
+APIFY_TERMINAL_STATUSES = ("SUCCEEDED", "FAILED", "TIMED-OUT", "ABORTED")
+
+
+class IncompleteCrawlError(Exception):
+    """クロールが SUCCEEDED 以外で終了した場合に、取得できたアイテムを返し終えてから送出する。"""
+
+    def __init__(self, url, status):
+        super().__init__(f"スクレイピングが正常に終了しませんでした（{status}）: {url}")
+        self.url = url
+        self.status = status
+
+def iter_scrape_url_pages(url, force_refresh=False, page_size=SCRAPE_STREAM_PAGE_SIZE, poll_interval=SCRAPE_POLL_INTERVAL_SECONDS):
+    """
+    アクターの完了を待たずに、データセットに追加されたアイテムをページ単位で順に返すジェネレーター。
+
+    静的なページはHTTPで直接取得して一度に返す。それ以外はアクターを開始してステータスをポーリングし、
+    新しいアイテムがあればその都度 yield する。
+    キャッシュがある場合はキャッシュの内容を返し、クロールが成功した場合は全アイテムをキャッシュに保存する。
+    クロールが失敗・タイムアウト・中断した場合は、取得できたアイテムを返し終えてから IncompleteCrawlError を送出する。
+    呼び出し元が途中でやめた場合（例外で抜けた・close() した）は、実行中のアクターを中断する。
+    """
+    url = url.strip()
+    cache_key = f"apify-wcc:{normalize_url(url)}"
+    if scrape_cache is not None and not force_refresh:
+        cached_items = scrape_cache.get(cache_key)
+        if cached_items is not None:
+            for start in range(0, len(cached_items), page_size):
+                yield cached_items[start:start + page_size]
+            return
+
+    fast_path_items = _scrape_url_fast_path(url)
+    if fast_path_items:
+        if scrape_cache is not None:
+            scrape_cache.put(cache_key, fast_path_items)
+        yield fast_path_items
+        return
+
+    apify_client = ApifyClient(apifyapi_key)
+    run = apify_client.actor('apify/website-content-crawler').start(
+        run_input=_wcc_run_input(url),
+        timeout_secs=120
+    )
+    run_client = apify_client.run(run['id'])
+    dataset_client = apify_client.dataset(run['defaultDatasetId'])
+
+    all_items = []
+    status = None
+    try:
+        while True:
+            # ステータスを先に確認し、終了していれば残りのアイテムを読み切ってから抜ける
+            status = run_client.get()['status']
+            while True:
+                items = dataset_client.list_items(offset=len(all_items), limit=page_size).items
+                if not items:
+                    break
+                all_items.extend(items)
+                yield items
+            if status in APIFY_TERMINAL_STATUSES:
+                break
+            time.sleep(poll_interval)
+    finally:
+        # 呼び出し元が途中でやめた（例外・close()）場合は、アクターを動かし続けないよう中断する
+        if status not in APIFY_TERMINAL_STATUSES:
+            try:
+                run_client.abort()
+                logger.info(f"スクレイピングを中断しました: {url}")
+            except Exception as e:
+                logger.warning(f"スクレイピングを中断できませんでした: {url} {e}")
+
+    if status != "SUCCEEDED":
+        raise IncompleteCrawlError(url, status)
+    if scrape_cache is not None and all_items:
+        scrape_cache.put(cache_key, all_items)
+
 
 
 
@@ -102,61 +371,438 @@ def prepare_text_and_metadata(combined_data):
 
 
 # テキストをチャンクに
+def create_text_splitter(name=TEXT_SPLITTER, chunk_size=1000, chunk_overlap=100):
+    """設定に応じたテキスト分割器を作る（"langchain" または "japanese"）。"""
+    if name == "japanese":
+        return JapaneseTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    if name == "langchain":
+        return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    raise ValueError(f"未対応のテキスト分割方法です: {name}")
+
+# 呼び出しごとに作り直さず、全セッションで共有する
+text_splitter = create_text_splitter()
+
 def split_text(combined_text):
-    set_chunk_length = 1000
-    set_chunk_overlap = 100
-    chunks = RecursiveCharacterTextSplitter(chunk_size = set_chunk_length, chunk_overlap = set_chunk_overlap)
-    return chunks.split_text(combined_text)
+    return text_splitter.split_text(combined_text)
 
-from sentence_transformers import SentenceTransformer
+def iter_split_text(texts, buffer_chars=8000):
+    """
+    ページなどの単位で届くテキストを、全体を連結せずに順にチャンク化する。
 
-def make_chunks_embeddings(chunks):
-    # モデルのロード
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    embeddings = model.encode(chunks)
+    まだ続きがあるかもしれない最後のチャンクは次のテキストと合わせて分割し直すため、
+    ページをまたぐチャンクの区切りも全体を一度に分割した場合とほぼ同じになる。
 
+    :param texts: テキストのイテレータ（ページ単位など）
+    :param buffer_chars: 溜まったテキストがこの文字数を超えたら分割する
+    """
+    buffer = ""
+    for text in texts:
+        buffer += text
+        if len(buffer) < buffer_chars:
+            continue
+        chunks = split_text(buffer)
+        if not chunks:
+            buffer = ""
+            continue
+        # 最後のチャンクは次のテキストとつなげて分割し直す。チャンクは前後の空白が除かれているため、
+        # ページ末尾の改行などを失わないよう元のテキストの該当位置から後ろをそのまま持ち越す
+        yield from chunks[:-1]
+        offset = buffer.rfind(chunks[-1])
+        buffer = buffer[offset:] if offset >= 0 else chunks[-1] + "\n"
+    if buffer:
+        yield from split_text(buffer)
+
+
+def iter_batches(items, batch_size):
+    """イテレータを batch_size 件ずつのリストに分けて返す。"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _tokens_per_second(stats):
+    if not stats["encode_seconds"]:
+        return None
+    return round(stats["encoded_tokens"] / stats["encode_seconds"], 1)
+
+def make_chunks_embeddings(chunks, return_stats=False):
+    # プロセス内で共有している埋め込みバックエンドを取得
+    backend = get_embedding_backend(EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND)
+    encode_stats = {"encoded_tokens": 0, "encode_seconds": 0.0}
+
+    def _encode(texts):
+        # チャンク数が多い場合のみワーカープロセスに分散する
+        if embedding_pool is not None and len(texts) >= EMBEDDING_POOL_MIN_CHUNKS:
+            stats = {}
+            embeddings = embedding_pool.encode(texts, stats)
+        elif not EMBEDDING_BUCKETING:
+            return backend.encode(texts)
+        else:
+            embeddings, stats = encode_bucketed(backend, texts, token_budget=EMBEDDING_BATCH_TOKEN_BUDGET or None)
+        encode_stats["encoded_tokens"] += stats["encoded_tokens"]
+        encode_stats["encode_seconds"] += stats["encode_seconds"]
+        return embeddings
+
+    if chunk_embedding_store is not None:
+        # 保存済みのチャンクは再利用し、新しいチャンクだけをエンコードする
+        embeddings, stats = chunk_embedding_store.embed_with_cache(backend.model_id, chunks, _encode)
+    else:
+        embeddings = _encode(chunks)
+        stats = {"total_chunks": len(chunks), "reused_chunks": 0, "encoded_chunks": len(chunks)}
+    stats.update(encode_stats)
+    stats["tokens_per_second"] = _tokens_per_second(stats)
+    logger.info(f"チャンク埋め込み: {stats}")
+
+    if return_stats:
+        return embeddings, stats
     return embeddings
 
 
 
 ### pinecone処理
 def initialize_pinecone(pinecone_index_name, pinecone_api_key):
-    pinecone = Pinecone(api_key=pinecone_api_key)
-    index = pinecone.Index(pinecone_index_name)
-    return index
+    # 接続プールから既存のIndexを取得（無ければ作成）
+    return pinecone_pool.get_index(pinecone_api_key, pinecone_index_name)
+
+
+# numpyバックエンドは (テナント, インデックス名) ごとにプロセス内で共有する
+_numpy_vector_stores = {}
+
+
+def initialize_vector_store(index_name, pinecone_api_key):
+    """設定(VECTOR_STORE_BACKEND, SLIM_VECTOR_METADATA, RETRIEVAL_CACHE_SIZE)に応じたVectorStoreを返す。"""
+    # 同じインデックス名でもAPIキーが違えば別のテナントとして扱う
+    tenant = api_key_hash(pinecone_api_key)
+    if VECTOR_STORE_BACKEND == "numpy":
+        if (tenant, index_name) not in _numpy_vector_stores:
+            path = os.path.join(VECTOR_STORE_NUMPY_DIR, f"{tenant}_{index_name}.npz") if VECTOR_STORE_NUMPY_DIR else None
+            _numpy_vector_stores[(tenant, index_name)] = NumpyVectorStore(name=index_name, path=path, tenant=tenant)
+        store = _numpy_vector_stores[(tenant, index_name)]
+    else:
+        store = PineconeVectorStore(initialize_pinecone(index_name, pinecone_api_key), name=index_name, tenant=tenant)
+
+    if chunk_text_store is not None:
+        # チャンク本文などはローカルに保存し、インデックスにはフィルタ用の項目だけを残す
+        store = SlimMetadataVectorStore(store, chunk_text_store)
+    if retrieval_cache is not None:
+        # 同じ生成指示での再生成時にベクトルDBへの問い合わせを省略する
+        store = CachedVectorStore(store, retrieval_cache)
+    return store
+
+
+def upload_vectors(index, vectors, namespace, progress_callback=None):
+    """ベクトルをバイト数・件数で区切ったバッチに分け、並列数を制限してアップロードする。"""
+    return upsert_in_batches(
+        as_vector_store(index),
+        vectors,
+        namespace,
+        max_vectors=UPSERT_BATCH_MAX_VECTORS,
+        max_bytes=UPSERT_BATCH_MAX_BYTES,
+        max_workers=UPSERT_MAX_WORKERS,
+        max_retries=UPSERT_MAX_RETRIES,
+        progress_callback=progress_callback,
+    )
+
+
+def make_source_id(source_type, source):
+    """登録元（URLまたはPDFファイル名）を表すIDを作る。URLは正規化してから使う。"""
+    if source_type == "url":
+        source = canonicalize_url(source)
+    return f"{source_type}:{source}"
+
+
+def source_id_prefix(source_id):
+    """登録元ごとに共通なベクトルIDの前半部分。登録元単位でのID一覧取得(プレフィックス検索)に使う。"""
+    return hashlib.sha256(source_id.encode("utf-8")).hexdigest()[:16] + "#"
+
+
+def make_vector_id(source_id, chunk):
+    """登録元IDとチャンク本文のハッシュから決定的なベクトルIDを作る。"""
+    return source_id_prefix(source_id) + hashlib.sha256(chunk.encode("utf-8")).hexdigest()[:32]
+
+
+# 旧形式のID（"{URL}-chunk-{i}" / "pdf-chunk-{i}"）を探すときに一度に確認する件数と上限
+LEGACY_ID_PROBE_BATCH_SIZE = 100
+LEGACY_ID_PROBE_MAX = 10000
+
+
+def find_legacy_vector_ids(store, namespace, source_type, source):
+    """
+    チャンクの連番をIDにしていた頃に登録されたベクトルのIDを返す。
+
+    URLは "{original_url}-chunk-{i}"、PDFはファイルに関係なく "pdf-chunk-{i}" で登録されていたため、
+    PDFはメタデータのファイル名が一致するものだけを返す。連番を先頭から確認し、見つからなくなったら止める。
+
+    :param source: URLの場合はスクレイピング結果の original_url、PDFの場合はファイル名
+    """
+    found = []
+    for start in range(0, LEGACY_ID_PROBE_MAX, LEGACY_ID_PROBE_BATCH_SIZE):
+        if source_type == "url":
+            candidates = [f"{source}-chunk-{i}" for i in range(start, start + LEGACY_ID_PROBE_BATCH_SIZE)]
+        else:
+            candidates = [f"pdf-chunk-{i}" for i in range(start, start + LEGACY_ID_PROBE_BATCH_SIZE)]
+        vectors = store.fetch(candidates, namespace)
+        if not vectors:
+            break
+        if source_type == "url":
+            found.extend(vectors)
+        else:
+            found.extend(
+                vector_id for vector_id, vector in vectors.items()
+                if vector["metadata"].get("pdf_filename") == source
+            )
+    if found:
+        logger.info(f"{source}: 旧形式のIDで登録されたチャンクが{len(found)}件見つかりました")
+    return found
+
+
+def resolve_existing_ids(store, source_id, namespace, existing_ids=None, legacy_source=None):
+    """
+    登録元の保存済みベクトルIDを集合で返す。
+
+    保存済みIDはカタログ（DocumentCatalogService.get_vector_ids）から渡すのが前提。
+    pinecone-client 3.0 にはIDの一覧取得(Index.list)が無いため、VectorStoreからは取得できない場合が多い。
+    カタログに記録の無い登録元は、一覧取得できたIDと旧形式のIDを保存済みとして扱う。
+
+    :param existing_ids: カタログに記録された保存済みのID。Noneの場合はカタログに記録が無いものとして探す
+    :param legacy_source: 旧形式のIDを探すための (登録元の種類, original_url またはファイル名)
+    """
+    if existing_ids is not None:
+        return set(existing_ids)
+    ids = set()
+    try:
+        ids.update(store.list_ids(source_id_prefix(source_id), namespace))
+    except NotImplementedError:
+        pass
+    if legacy_source is not None:
+        ids.update(find_legacy_vector_ids(store, namespace, *legacy_source))
+    return ids
+
+
+# make_chunks_embeddings の統計情報のうち、バッチごとに足し合わせる項目
+_EMBED_STAT_KEYS = ("total_chunks", "reused_chunks", "encoded_chunks", "encoded_tokens", "encode_seconds")
+
+
+def _sync_chunk_batches(store, source_id, batches, metadata, namespace, existing, is_complete=None,
+                        upload_progress=None, on_batch=None, started=None):
+    """
+    登録元のチャンクをバッチごとにアップロードし、最後に無くなったチャンクを削除して差分を反映する。
+
+    sync_source_vectors・ingest_url_streaming・ingest_pdf_streaming に共通の処理。
+    保存済みのID・このソースで既に出てきたIDのチャンクはアップロードしない。
+
+    :param batches: チャンクのリスト、または (チャンクのリスト, 埋め込み行列) を返すイテレータ。埋め込みが無いバッチはここで埋め込む
+    :param existing: 保存済みのIDの集合（resolve_existing_ids の結果）
+    :param is_complete: すべてのバッチを処理した後に呼ぶ関数。Falseを返した場合は削除を行わず、保存済みのIDを vector_ids に残す
+    :param upload_progress: upload_vectors に渡す進捗通知の関数
+    :param on_batch: on_batch(登録チャンク数) の形でバッチごとに呼ぶ関数
+    :param started: 所要秒数の起点（time.perf_counter()の値）。Noneの場合はこの関数の開始時
+    :return: 統計情報の辞書（アップロード件数、削除件数、変更なしの件数、このソースの全ID、チャンク埋め込みの再利用件数など）
+    """
+    started = started or time.perf_counter()
+    vector_ids = {}
+    stats = {"upserted": 0, **{key: 0 for key in _EMBED_STAT_KEYS}}
+    for batch in batches:
+        chunks, embeddings = batch if isinstance(batch, tuple) else (batch, None)
+        if embeddings is None:
+            embeddings, embed_stats = make_chunks_embeddings(chunks, return_stats=True)
+            for key in _EMBED_STAT_KEYS:
+                stats[key] += embed_stats[key]
+
+        vectors = [
+            vector for vector in _build_vectors(source_id, embeddings, chunks, metadata)
+            if vector["id"] not in vector_ids
+        ]
+        vector_ids.update((vector["id"], None) for vector in vectors)
+        vectors_to_upsert = [vector for vector in vectors if vector["id"] not in existing]
+        stats["upserted"] += upload_vectors(store, vectors_to_upsert, namespace, upload_progress)["upserted"]
+        if on_batch:
+            on_batch(len(vector_ids))
+
+    if is_complete is None or is_complete():
+        # 今回見つからなかったチャンク（旧形式のIDのものを含む）を削除
+        ids_to_delete = sorted(existing - set(vector_ids))
+        if ids_to_delete:
+            store.delete(ids_to_delete, namespace)
+    else:
+        # 途中までの結果では削除してよいか判断できないため、保存済みのチャンクは残す
+        ids_to_delete = []
+        vector_ids.update((vector_id, None) for vector_id in sorted(existing - set(vector_ids)))
+    # まとめて永続化するバックエンドでは、登録の最後に一度だけ保存する
+    store.flush()
+
+    elapsed = time.perf_counter() - started
+    stats.update({
+        "source_id": source_id,
+        "total": len(vector_ids),
+        "deleted": len(ids_to_delete),
+        "unchanged": len(vector_ids) - stats["upserted"],
+        "vector_ids": list(vector_ids),
+        "seconds": round(elapsed, 3),
+        "vectors_per_second": round(stats["upserted"] / elapsed, 1) if elapsed else None,
+        "tokens_per_second": _tokens_per_second(stats),
+    })
+    return stats
+
+
+def sync_source_vectors(index, source_id, chunk_embeddings, chunks, metadata, namespace, existing_ids=None,
+                        progress_callback=None, legacy_source=None):
+    """
+    登録元ごとに、保存済みのベクトルと新しいチャンクを比較して差分だけを反映する。
+
+    新しいチャンクだけをアップロードし、無くなったチャンク（旧形式のIDのものを含む）だけを削除する。
+
+    :param chunk_embeddings: chunks の埋め込み行列
+    :param existing_ids: カタログに記録された保存済みのID。Noneの場合は resolve_existing_ids で探す
+    :param legacy_source: 旧形式のIDを探すための (登録元の種類, original_url またはファイル名)
+    :return: 統計情報の辞書（アップロード件数、削除件数、変更なしの件数、このソースの全ID）
+    """
+    store = as_vector_store(index)
+    existing = resolve_existing_ids(store, source_id, namespace, existing_ids, legacy_source)
+    stats = _sync_chunk_batches(
+        store, source_id, [(chunks, chunk_embeddings)], metadata, namespace, existing, upload_progress=progress_callback,
+    )
+    logger.info(
+        f"{source_id}: 追加 {stats['upserted']}件 / 削除 {stats['deleted']}件 / 変更なし {stats['unchanged']}件"
+    )
+    return stats
+
+
+def _build_vectors(source_id, chunk_embeddings, chunks, metadata):
+    vectors = {}
+    for embedding, chunk in zip(chunk_embeddings, chunks):
+        # 同じ内容のチャンクは同じIDになるため一つにまとめる
+        vector_id = make_vector_id(source_id, chunk)
+        vectors[vector_id] = {
+            "id": vector_id,
+            "values": embedding.tolist(),  # numpy配列をリストに変換
+            "metadata": {**metadata, "source_id": source_id, "text_chunk": chunk}
+        }
+    return list(vectors.values())
+
+
+def _url_metadata(common_metadata):
+    return {
+        "original_url": common_metadata['original_url'],
+        "description": common_metadata['description'],
+        "title": common_metadata['title'],
+        "keywords": common_metadata['keywords'],
+    }
 
 
-def store_data_in_pinecone(index, chunk_embeddings, chunks, metadata_list, namespace):
+def store_data_in_pinecone(index, chunk_embeddings, chunks, metadata_list, namespace, progress_callback=None, existing_ids=None):
     # 最初のメタデータを使用（共通部分）
     common_metadata = metadata_list[0]
+    source_id = make_source_id("url", common_metadata['original_url'])
 
-    vectors_to_upsert = []
-    for i, (embedding, chunk) in enumerate(zip(chunk_embeddings, chunks)):
-        # 一意のIDの生成
-        unique_id = f"{common_metadata['original_url']}-chunk-{i}"
+    # 変更のあったチャンクだけをアップロード・削除
+    return sync_source_vectors(
+        index, source_id, chunk_embeddings, chunks, _url_metadata(common_metadata), namespace, existing_ids,
+        progress_callback, legacy_source=("url", common_metadata['original_url']),
+    )
 
-        # メタデータにテキストチャンクを追加
-        metadata = {
-            "original_url": common_metadata['original_url'],
-            "description": common_metadata['description'],
-            "title": common_metadata['title'],
-            "keywords": common_metadata['keywords'],
-            "text_chunk": chunk  # テキストチャンクを追加
-        }
+def ingest_url_streaming(index, url, namespace, get_existing_ids=None, force_refresh=False, progress_callback=None):
+    """
+    クロールと並行して、取得できたページから順にチャンク化・埋め込み・アップロードを行う。
 
-        # ベクトルとメタデータをリストに追加
-        vectors_to_upsert.append({
-            "id": unique_id,
-            "values": embedding.tolist(),  # numpy配列をリストに変換
-            "metadata": metadata
-        })
+    無くなったチャンクの削除はクロールが成功して終わった場合にだけ行う。失敗・タイムアウトした場合は
+    取得できた分だけを追加し、保存済みのチャンクは残す（vector_ids には残したチャンクも含める）。
+
+    :param get_existing_ids: ソースIDを受け取り保存済みIDを返す関数（カタログなど）。Noneを返した場合は resolve_existing_ids で探す
+    :param progress_callback: progress_callback(取得ページ数, 登録チャンク数) の形で進捗を通知する関数
+    :return: 統計情報の辞書（store_data_in_pineconeと同じ項目に加え、ページ数・チャンク埋め込みの再利用件数・クロールの終了ステータス）
+    """
+    store = as_vector_store(index)
+    started = time.perf_counter()
+    crawl = {"status": "SUCCEEDED", "pages": 0}
+    pages = iter_scrape_url_pages(url, force_refresh=force_refresh)
 
-    # 一度に全てのベクトルをアップロード
-    index.upsert(vectors=vectors_to_upsert, namespace=namespace)
+    def _next_items():
+        try:
+            return next(pages)
+        except StopIteration:
+            return None
+        except IncompleteCrawlError as e:
+            logger.warning(str(e))
+            crawl["status"] = e.status
+            return None
+
+    def _batches(items, combined_text):
+        while True:
+            crawl["pages"] += len(items)
+            yield split_text(combined_text)
+            items = _next_items()
+            if items is None:
+                return
+            combined_text, _ = prepare_text_and_metadata(extract_keys_from_json(items))
+
+    try:
+        items = _next_items()
+        if items is None:
+            raise ValueError(f"スクレイピング結果がありませんでした（{crawl['status']}）: {url}")
+        combined_text, metadata_list = prepare_text_and_metadata(extract_keys_from_json(items))
+        # 最初のページの最初のアイテムをソース全体の共通メタデータとして使う（一括登録と同じ）
+        common_metadata = metadata_list[0]
+        source_id = make_source_id("url", common_metadata['original_url'])
+        existing = resolve_existing_ids(
+            store, source_id, namespace,
+            get_existing_ids(source_id) if get_existing_ids else None,
+            legacy_source=("url", common_metadata['original_url']),
+        )
+        stats = _sync_chunk_batches(
+            store, source_id, _batches(items, combined_text), _url_metadata(common_metadata), namespace, existing,
+            # 無くなったチャンクの削除はクロールが成功して終わった場合にだけ行う
+            is_complete=lambda: crawl["status"] == "SUCCEEDED",
+            on_batch=(lambda chunks: progress_callback(crawl["pages"], chunks)) if progress_callback else None,
+            started=started,
+        )
+    finally:
+        # アップロードなどで失敗した場合も、実行中のクロールを中断する
+        pages.close()
+
+    stats.update({
+        "pages": crawl["pages"],
+        "title": common_metadata['title'],
+        "crawl_status": crawl["status"],
+    })
+    logger.info(f"{source_id}: {stats['pages']}ページ / 追加 {stats['upserted']}件 / 削除 {stats['deleted']}件")
+    return stats
 
-    # 保存したIDをプリント（オプション）
-    for vector in vectors_to_upsert:
-        print(f"Saved: {vector['id']}")
+def wait_for_vectors_ready(index, namespace, expected_count=None, probe_ids=None, max_wait=READINESS_MAX_WAIT_SECONDS, initial_interval=0.25):
+    """
+    書き込んだベクトルが読めるようになるまで、指数バックオフでポーリングして待つ。
+
+    :param expected_count: ネームスペースのベクトル数がこの件数以上になるまで待つ
+    :param probe_ids: これらのIDがすべて取得できるようになるまで待つ
+    :param max_wait: 待つ最大秒数（超えた場合は準備できていなくても戻る）
+    :return: {"ready": 準備できたか, "waited_seconds": 待った秒数}
+    """
+    store = as_vector_store(index)
+    started = time.perf_counter()
+    interval = initial_interval
+    while True:
+        ready = True
+        if expected_count is not None:
+            ready = store.namespace_vector_count(namespace) >= expected_count
+        if ready and probe_ids:
+            ready = len(store.fetch(probe_ids, namespace)) >= len(set(probe_ids))
+
+        elapsed = time.perf_counter() - started
+        if ready or elapsed >= max_wait:
+            break
+        time.sleep(min(interval, max_wait - elapsed))
+        interval *= 2
+
+    waited = round(time.perf_counter() - started, 3)
+    if ready:
+        logger.info(f"ネームスペース '{namespace}' の反映を確認しました（{waited}秒）")
+    else:
+        logger.warning(f"ネームスペース '{namespace}' の反映を{max_wait}秒以内に確認できませんでした")
+    return {"ready": ready, "waited_seconds": waited}
 
 # シミラリティ検索を実行する関数
 # def perform_similarity_search(index, query, namespace, top_k=3):
@@ -172,7 +818,7 @@ def perform_similarity_search(index, query, namespace, top_k=3):
     """
     指定したインデックスでセマンティック検索を実行し、最も類似した上位k個の結果を返す。
 
-    :param index: Pineconeのインデックスオブジェクト
+    :param index: VectorStore（またはPineconeのインデックスオブジェクト）
     :param query: 検索に使用するクエリテキスト
     :param namespace: 使用する名前空間
     :param top_k: 返される結果の数
@@ -184,10 +830,10 @@ def perform_similarity_search(index, query, namespace, top_k=3):
     # logger.info(query_embedding.tolist())
 
     # クエリの実行
-    search_results = index.query(
-        namespace=namespace,
-        vector=query_embedding.tolist(),
+    search_results = as_vector_store(index).query(
+        query_embedding.tolist(),
         top_k=top_k,
+        namespace=namespace,
         include_metadata=True
     )
 
@@ -209,72 +855,253 @@ def get_search_results_titles(search_results):
 
 # クエリの埋め込みベクトルを生成する関数
 def generate_query_embedding(query):
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    return model.encode([query])[0]
+    backend = get_embedding_backend(EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND)
+
+    # 同じ（正規化後に一致する）クエリはエンコーダーを通さずキャッシュから返す
+    return query_embedding_cache.get_or_compute(backend.model_id, query, lambda text: backend.encode([text])[0])
 
 def delete_all_data_in_namespace(index, namespace):
-    index.delete(delete_all=True, namespace=namespace)
+    as_vector_store(index).delete_all(namespace)
     print(f"次のネームスペースから全データが削除されました： '{namespace}'.")
 
 
 
-def delete_data_by_url(index, namespace, url):
-    # 名前空間内のすべてのIDを取得
-    all_ids = index.describe_index_stats(namespace=namespace)["namespaces"][namespace]["ids"]
+def delete_data_by_url(index, namespace, url, vector_ids=None):
+    """
+    指定されたURLのチャンクを削除する。
 
-    # 指定されたURLに基づいてIDをフィルタリング
-    ids_to_delete = [id for id in all_ids if url in id]
+    :param vector_ids: カタログに記録されたこのURLのベクトルID。Noneの場合は一覧取得と旧形式のIDから探す
+    """
+    store = as_vector_store(index)
+    ids_to_delete = sorted(resolve_existing_ids(
+        store, make_source_id("url", url), namespace, vector_ids, legacy_source=("url", url),
+    ))
 
-    # フィルタリングされたIDを削除
-    index.delete(ids=ids_to_delete, namespace=namespace)
+    # 取得したIDを削除
+    store.delete(ids_to_delete, namespace)
     print(f"ネームスペース【'{namespace}'】から次のURLの全データ削除されました【'{url}'】.")
 
 
-def extract_text_from_pdf(pdf_file):
-    reader = PdfReader(pdf_file)
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text() + "\n"
-    return text
+def _page_text(page):
+    return (page.extract_text() or "") + "\n"
 
-def store_pdf_data_in_pinecone(index, chunk_embeddings, chunks, pdf_file_name, namespace):
-    vectors_to_upsert = []
-    for i, (embedding, chunk) in enumerate(zip(chunk_embeddings, chunks)):
-        unique_id = f"pdf-chunk-{i}"  # PDFチャンクのIDを設定
-        # メタデータにファイル名を使用
-        metadata = {
-            "pdf_filename": pdf_file_name,  # ファイル名をoriginal_urlとして使用
-            "title": pdf_file_name,  # ファイル名をタイトルとして使用
-            "description": "",  # 説明は空
-            "keywords": [],  # キーワードは空のリスト
-            "text_chunk": chunk  # テキストチャンクを追加
-        }
-        # ベクトルとメタデータをリストに追加
-        vectors_to_upsert.append({
-            "id": unique_id,
-            "values": embedding.tolist(),
-            "metadata": metadata
-        })
-    # 一度に全てのベクトルをアップロード
-    index.upsert(vectors=vectors_to_upsert, namespace=namespace)
-    # 保存したIDをプリント（オプション）
-    for vector in vectors_to_upsert:
-        print(f"Saved: {vector['id']}")
+def _read_pdf_bytes(pdf_file):
+    if hasattr(pdf_file, "getvalue"):
+        return pdf_file.getvalue()
+    pdf_file.seek(0)
+    return pdf_file.read()
+
+def open_pdf_pages(pdf_file, stats=None):
+    """
+    PDFの全ページ数と、ページのテキストを1ページずつ返すイテレータを返す（各ページの末尾に改行を付ける）。
+
+    同じ中身のPDFを抽出済みの場合はキャッシュから返す。ページ数が多い場合はワーカープロセスで並列に抽出する。
+
+    :param stats: 渡された場合、抽出秒数・1秒あたりのページ数・キャッシュを使ったかを書き込む
+    """
+    pdf_bytes = _read_pdf_bytes(pdf_file)
+    if pdf_text_cache is None:
+        return _extract_pdf_pages(pdf_bytes, stats)
+
+    cache_key = f"pdf-text:{hashlib.sha256(pdf_bytes).hexdigest()}"
+    cached_pages = pdf_text_cache.get(cache_key)
+    if stats is not None:
+        stats["extract_cache_hit"] = cached_pages is not None
+    if cached_pages is not None:
+        logger.info(f"PDF抽出: キャッシュを使用しました（{len(cached_pages)}ページ）")
+        return len(cached_pages), iter(cached_pages)
+
+    # タイムアウトしたページがあったかを確認するため、呼び出し元が stats を渡さない場合も集計する
+    extract_stats = stats if stats is not None else {}
+    total_pages, pages = _extract_pdf_pages(pdf_bytes, extract_stats)
+
+    def _pages_with_cache():
+        # ページはメモリに溜めず、1ページずつキャッシュファイルに書き出す
+        writer = pdf_text_cache.list_writer(cache_key)
+        try:
+            for text in pages:
+                writer.append(text)
+                yield text
+        except BaseException:
+            writer.abort()
+            raise
+        # 空として扱ったページがある場合は、次回抽出し直せるよう保存しない
+        if extract_stats.get("timed_out_pages"):
+            writer.abort()
+            logger.warning("PDF抽出: タイムアウトしたページがあるため、抽出結果をキャッシュしませんでした")
+            return
+        # 最後のページまで抽出できた場合だけ保存する
+        writer.commit()
+
+    return total_pages, _pages_with_cache()
+
+def _extract_pdf_pages(pdf_bytes, stats=None):
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    total_pages = len(reader.pages)
+    if pdf_extraction_pool is not None and total_pages >= PDF_EXTRACT_MIN_PAGES:
+        return total_pages, pdf_extraction_pool.iter_pages(pdf_bytes, total_pages, stats)
+
+    def _pages():
+        elapsed = 0.0
+        for page in reader.pages:
+            started = time.perf_counter()
+            text = _page_text(page)
+            elapsed += time.perf_counter() - started
+            yield text
+        if stats is not None:
+            stats.update({
+                "extract_seconds": round(elapsed, 3),
+                "pages_per_second": round(total_pages / elapsed, 1) if elapsed else None,
+            })
+
+    return total_pages, _pages()
+
+def iter_pdf_pages(pdf_file, stats=None):
+    """
+    PDFのページのテキストを1ページずつ返す（各ページの末尾に改行を付ける）。
+
+    :param stats: 渡された場合、open_pdf_pages と同じく抽出の統計情報を書き込む
+    """
+    return open_pdf_pages(pdf_file, stats)[1]
+
+def extract_text_from_pdf(pdf_file, stats=None):
+    return "".join(iter_pdf_pages(pdf_file, stats))
+
+def _pdf_metadata(pdf_file_name):
+    return {
+        "pdf_filename": pdf_file_name,  # ファイル名をoriginal_urlとして使用
+        "title": pdf_file_name,  # ファイル名をタイトルとして使用
+        "description": "",  # 説明は空
+        "keywords": [],  # キーワードは空のリスト
+    }
+
+def store_pdf_data_in_pinecone(index, chunk_embeddings, chunks, pdf_file_name, namespace, progress_callback=None, existing_ids=None):
+    source_id = make_source_id("pdf", pdf_file_name)
+    # メタデータにファイル名を使用し、変更のあったチャンクだけをアップロード・削除
+    return sync_source_vectors(
+        index, source_id, chunk_embeddings, chunks, _pdf_metadata(pdf_file_name), namespace, existing_ids,
+        progress_callback, legacy_source=("pdf", pdf_file_name),
+    )
+
+def ingest_pdf_streaming(index, pdf_file, namespace, existing_ids=None, batch_size=PDF_STREAM_BATCH_SIZE, progress_callback=None):
+    """
+    PDFをページ単位で読み込み、チャンク化・埋め込み・アップロードを一定件数ずつ行う。
+
+    テキスト全体・全チャンク・全埋め込みを同時に持たないため、PDFが大きくてもメモリ使用量は増えない。
+    無くなったチャンクの削除は最後に行う。
+
+    :param existing_ids: カタログに記録された保存済みのID。Noneの場合は resolve_existing_ids で探す
+    :param batch_size: 一度に埋め込み・アップロードするチャンク数（埋め込みプールがある場合は EMBEDDING_POOL_MIN_CHUNKS 以上にする）
+    :param progress_callback: progress_callback(処理したページ数, 全ページ数, 登録チャンク数) の形で進捗を通知する関数
+    :return: 統計情報の辞書（store_pdf_data_in_pineconeと同じ項目に加え、ページ数・抽出速度・チャンク埋め込みの再利用件数）
+    """
+    store = as_vector_store(index)
+    started = time.perf_counter()
+    if embedding_pool is not None:
+        # マルチプロセス埋め込みプールが使われる件数ずつ埋め込む
+        batch_size = max(batch_size, EMBEDDING_POOL_MIN_CHUNKS)
+    source_id = make_source_id("pdf", pdf_file.name)
+    existing = resolve_existing_ids(store, source_id, namespace, existing_ids, legacy_source=("pdf", pdf_file.name))
+
+    extract_stats = {"pages": 0}
+    total_pages, pages = open_pdf_pages(pdf_file, extract_stats)
+
+    def _pages():
+        for text in pages:
+            extract_stats["pages"] += 1
+            yield text
+
+    stats = _sync_chunk_batches(
+        store, source_id, iter_batches(iter_split_text(_pages()), batch_size), _pdf_metadata(pdf_file.name),
+        namespace, existing,
+        on_batch=(lambda chunks: progress_callback(extract_stats["pages"], total_pages, chunks)) if progress_callback else None,
+        started=started,
+    )
+    stats.update(extract_stats)
+    logger.info(
+        f"{source_id}: {stats['pages']}ページ（{stats.get('pages_per_second')} ページ/秒） / "
+        f"追加 {stats['upserted']}件 / 削除 {stats['deleted']}件"
+    )
+    return stats
+
+
+def query_namespaces_concurrently(index, query_embedding, namespaces, top_k=3, timeout=NAMESPACE_QUERY_TIMEOUT):
+    """
+    複数のネームスペースに対する検索を並列に実行する。
+
+    :param index: VectorStore（またはPineconeのインデックスオブジェクト）
+    :param query_embedding: 検索に使うクエリの埋め込みベクトル
+    :param namespaces: 検索するネームスペースのリスト
+    :param top_k: 各ネームスペースで返される結果の数
+    :param timeout: 各ネームスペースの検索を待つ最大秒数
+    :return: {ネームスペース: 検索結果} の辞書。タイムアウトしたネームスペースは含まれない
+    """
+    store = as_vector_store(index)
+    vector = query_embedding.tolist()
+    latencies = {}
+
+    def _query(ns):
+        started = time.perf_counter()
+        try:
+            return store.query(vector, top_k=top_k, namespace=ns, include_metadata=True)
+        finally:
+            latencies[ns] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    futures = {ns: namespace_query_executor.submit(_query, ns) for ns in namespaces}
+    deadline = started + timeout
+
+    search_results_by_ns = {}
+    for ns, future in futures.items():
+        try:
+            search_results_by_ns[ns] = future.result(timeout=max(0, deadline - time.perf_counter()))
+        except FutureTimeoutError:
+            future.cancel()
+            logger.warning(f"ネームスペース '{ns}' の検索が{timeout}秒以内に終わりませんでした")
+
+    logger.info(
+        f"ネームスペース検索: 合計 {time.perf_counter() - started:.3f}秒 / ネームスペースごと {latencies}"
+    )
+    return search_results_by_ns
+
+
+def pack_search_results(search_results_by_ns, results):
+    """
+    ネームスペースごとの検索結果を、トークン予算(CONTEXT_TOKEN_BUDGET)に収まるよう整形し直す。
+
+    :param search_results_by_ns: {ネームスペース: 検索結果}
+    :param results: 従来の方法で整形した {ネームスペース: テキスト}（整形前のトークン数の記録に使う）
+    :return: {ネームスペース: テキスト}
+    """
+    matches_by_ns = {}
+    for ns, search_results in search_results_by_ns.items():
+        metadata_list = [match['metadata'] for match in search_results.get('matches', [])]
+        # ns3は従来どおり最上位の結果のみを使う
+        matches_by_ns[ns] = metadata_list[:1] if ns == "ns3" else metadata_list
+
+    packed = pack_context(matches_by_ns, CONTEXT_TOKEN_BUDGET, CONTEXT_NAMESPACE_WEIGHTS)
+    tokens_before = {ns: count_tokens(text) for ns, text in results.items()}
+    tokens_after = {ns: count_tokens(text) for ns, text in packed.items()}
+    logger.info(
+        f"コンテキストのトークン数: {sum(tokens_before.values())} -> {sum(tokens_after.values())} "
+        f"(整形前 {tokens_before} / 整形後 {tokens_after})"
+    )
+    return packed
 
 
 def generate_response_with_llm_for_multiple_namespaces(index, user_input, namespaces, selected_llm, system_prompt, project_name):
     results = {}  # 各名前空間の検索結果を格納する辞書
 
-    # 名前空間ごとに検索結果を取得
+    # クエリの埋め込みは一度だけ作り、全ネームスペースを並列に検索する
+    query_embedding = generate_query_embedding(user_input)
+    search_results_by_ns = query_namespaces_concurrently(index, query_embedding, namespaces, top_k=3)
+
+    # 名前空間ごとに検索結果を整形
     for ns in namespaces:
+        if ns not in search_results_by_ns:
+            continue
         try:
-            query_embedding = generate_query_embedding(user_input)
-            search_results = index.query(
-                namespace=ns,
-                vector=query_embedding.tolist(),
-                top_k=3,
-                include_metadata=True
-            )
+            search_results = search_results_by_ns[ns]
             if ns == "ns3":
                 # ns3のメタデータを直接利用する特別な処理
                 if search_results['matches']:
@@ -297,6 +1124,10 @@ def generate_response_with_llm_for_multiple_namespaces(index, user_input, namesp
             print(f"エラーが発生しました: 名前空間 '{ns}' で {e} キーが見つかりません。")
             results[ns] = "エラー: 検索結果が見つかりませんでした。"
 
+    if CONTEXT_TOKEN_BUDGET > 0:
+        # 重複や冗長なメタデータを除き、トークン予算に収まるように詰め直す
+        results = pack_search_results(search_results_by_ns, results)
+
     # プロンプトテンプレートの準備
     prompt_template = PromptTemplate(template=system_prompt, input_variables=["user_input", "results_ns1", "results_ns2", "results_ns3", "results_ns4", "results_ns5"])
 
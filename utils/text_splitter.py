@@ -0,0 +1,72 @@
+import re
+from bisect import bisect_left, bisect_right
+
+# 文末（句点・感嘆符・疑問符）と改行を区切りとする。区切り文字はその直前の文に含める
+_BOUNDARY_PATTERN = re.compile(r"[。．！？!?]+[」』）)]*|\n+")
+# 上の区切りが無い場合に順に使う区切り（英文のピリオドの後の空白、単語の間の空白）
+_FALLBACK_PATTERNS = (
+    re.compile(r"\.[\"')\]]*(?=\s)"),
+    re.compile(r"\s+"),
+)
+
+
+class JapaneseTextSplitter:
+    """
+    日本語向けのテキスト分割。
+
+    文末記号と改行の位置を一度だけ走査して区切り候補のオフセットを集め、
+    chunk_size 以内に収まる最後の区切りでチャンクを切る。区切りが無い場合は英文のピリオド、空白の順に区切りを探し、
+    それも無い場合は chunk_size 文字で切る。
+    次のチャンクは chunk_overlap 文字以内に収まる文から始めるため、
+    RecursiveCharacterTextSplitter と同じく「最大 chunk_size 文字・文単位で最大 chunk_overlap 文字の重複」になる。
+    """
+
+    def __init__(self, chunk_size=1000, chunk_overlap=100):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap は chunk_size より小さくしてください")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def _boundaries(self, text):
+        return [match.end() for match in _BOUNDARY_PATTERN.finditer(text)]
+
+    def _find_end(self, levels, text, start, limit):
+        """start より後で limit 以下の最後の区切りを、優先度の高い区切りから順に探す。見つからない場合は (None, None)。"""
+        for level, pattern in enumerate((None,) + _FALLBACK_PATTERNS):
+            if level >= len(levels):
+                # 予備の区切りは必要になったときに一度だけ走査する
+                levels.append([match.end() for match in pattern.finditer(text)])
+            boundaries = levels[level]
+            i = bisect_right(boundaries, limit) - 1
+            if i >= 0 and boundaries[i] > start:
+                return boundaries, boundaries[i]
+        return None, None
+
+    def split_text(self, text):
+        levels = [self._boundaries(text)]
+        length = len(text)
+        chunks = []
+        start = 0
+        while start < length:
+            limit = start + self.chunk_size
+            if limit >= length:
+                boundaries, end = levels[0], length
+            else:
+                boundaries, end = self._find_end(levels, text, start, limit)
+
+            if end is None:
+                # 空白も無い長い文字列は chunk_size 文字で切り、文字数で重複させる
+                chunk = text[start:limit].strip()
+                next_start = limit - self.chunk_overlap
+            else:
+                chunk = text[start:end].strip()
+                # end から chunk_overlap 文字以内で最初の区切りから次のチャンクを始める
+                j = bisect_left(boundaries, max(end - self.chunk_overlap, start + 1))
+                next_start = boundaries[j] if j < len(boundaries) and boundaries[j] < end else end
+
+            if chunk:
+                chunks.append(chunk)
+            if end == length:
+                break
+            start = next_start
+        return chunks
@@ -0,0 +1,107 @@
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+
+class UpsertError(Exception):
+    """リトライしてもアップロードできなかったバッチがある場合に送出する。"""
+
+    def __init__(self, message, stats):
+        super().__init__(message)
+        self.stats = stats
+
+
+def _vector_size(vector):
+    # リクエストボディに近いサイズになるようJSONにした長さで見積もる
+    return len(json.dumps(vector, ensure_ascii=False).encode("utf-8"))
+
+
+def iter_upsert_batches(vectors, max_vectors=100, max_bytes=1_500_000):
+    """件数とシリアライズ後のバイト数の両方が上限を超えないようにベクトルをバッチに分ける。"""
+    batch = []
+    batch_bytes = 0
+    for vector in vectors:
+        size = _vector_size(vector)
+        if batch and (len(batch) >= max_vectors or batch_bytes + size > max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(vector)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+def _upsert_with_retry(store, batch, namespace, max_retries, backoff_seconds):
+    for attempt in range(max_retries + 1):
+        try:
+            store.upsert(batch, namespace)
+            return
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            # 指数バックオフ（ジッター付き）
+            delay = backoff_seconds * (2 ** attempt) * (0.5 + random.random())
+            logger.warning(f"アップロードに失敗したため{delay:.1f}秒後に再試行します（{attempt + 1}/{max_retries}）: {e}")
+            time.sleep(delay)
+
+
+def upsert_in_batches(store, vectors, namespace, max_vectors=100, max_bytes=1_500_000, max_workers=4,
+                      max_retries=4, backoff_seconds=0.5, progress_callback=None):
+    """
+    ベクトルをバッチに分け、並列数を制限してアップロードする。
+
+    失敗したバッチはそのバッチだけをバックオフしながら再試行する。
+
+    :param store: VectorStore
+    :param vectors: アップロードするベクトルのリスト
+    :param namespace: 保存先のネームスペース
+    :param progress_callback: progress_callback(完了件数, 全件数) の形で進捗を通知する関数
+    :return: 統計情報の辞書（件数、バッチ数、所要秒数、1秒あたりの件数）
+    """
+    batches = list(iter_upsert_batches(vectors, max_vectors=max_vectors, max_bytes=max_bytes))
+    total = len(vectors)
+    done = 0
+    failed = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    if progress_callback:
+        progress_callback(0, total)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches) or 1))) as executor:
+        futures = {
+            executor.submit(_upsert_with_retry, store, batch, namespace, max_retries, backoff_seconds): batch
+            for batch in batches
+        }
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"{len(batch)}件のバッチのアップロードに失敗しました: {e}")
+                failed.append(batch)
+                continue
+            with lock:
+                done += len(batch)
+            if progress_callback:
+                progress_callback(done, total)
+
+    elapsed = time.perf_counter() - started
+    stats = {
+        "upserted": done,
+        "total": total,
+        "batches": len(batches),
+        "failed_batches": len(failed),
+        "seconds": round(elapsed, 3),
+        "vectors_per_second": round(done / elapsed, 1) if elapsed else None,
+    }
+    logger.info(f"アップロード完了: {stats}")
+    if failed:
+        raise UpsertError(f"{len(failed)}個のバッチをアップロードできませんでした", stats)
+    return stats
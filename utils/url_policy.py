@@ -0,0 +1,209 @@
+import importlib
+import ipaddress
+import logging
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+# 内容に影響しない計測用のクエリパラメータ
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "yclid", "msclkid", "igshid", "mc_cid", "mc_eid", "_ga", "_gl", "spm", "ref_src",
+}
+TRACKING_PARAM_PREFIXES = ("utm_",)
+DEFAULT_PORTS = {"http": "80", "https": "443"}
+
+
+def _is_tracking_param(name):
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PARAM_PREFIXES)
+
+
+def canonicalize_url(url):
+    """
+    同じページを指すURLが同じ文字列になるように正規化する。
+
+    スキームとホストを小文字にし、既定のポート・フラグメント・計測用パラメータ・末尾のスラッシュを除き、
+    残りのクエリパラメータを並べ替える。ポート番号が不正などで解釈できないURLは前後の空白だけを除いて返す。
+    正規化したURLはキャッシュやIDのキーに使うもので、取得には入力されたURLをそのまま使う。
+    """
+    url = url.strip()
+    if "://" not in url:
+        url = f"https://{url}"
+    try:
+        parts = urlsplit(url)
+        port = str(parts.port) if parts.port else ""
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if ":" in host:
+        # IPv6アドレスは角括弧で囲み直す
+        host = f"[{host}]"
+    netloc = host if not port or DEFAULT_PORTS.get(scheme) == port else f"{host}:{port}"
+
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/") or "/"
+    query = urlencode(sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not _is_tracking_param(name)
+    ))
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+
+class UnsafeUrlError(Exception):
+    """サーバーから取得してはいけないURL（内部ネットワークのアドレスなど）を取得しようとした場合に送出する。"""
+
+    def __init__(self, url, reason):
+        super().__init__(f"{reason}: {url}")
+        self.url = url
+        self.reason = reason
+
+
+def _is_public_address(address):
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def ensure_public_url(url, resolve=socket.getaddrinfo):
+    """
+    URLのホストがインターネット上のアドレスだけに解決されることを確かめる。
+
+    ループバック・プライベート・リンクローカル・予約済みなどのアドレスに解決される場合や、
+    http/https以外のURLの場合は UnsafeUrlError を送出する。
+
+    :param resolve: socket.getaddrinfo と同じ形の名前解決の関数
+    """
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        raise UnsafeUrlError(url, "URLを解釈できません")
+    if parts.scheme.lower() not in DEFAULT_PORTS or not parts.hostname:
+        raise UnsafeUrlError(url, "http/httpsのURLではありません")
+    try:
+        addresses = {info[4][0] for info in resolve(parts.hostname, port or DEFAULT_PORTS[parts.scheme.lower()])}
+    except (OSError, UnicodeError):
+        raise UnsafeUrlError(url, "ホスト名を解決できません")
+    if not addresses or not all(_is_public_address(address) for address in addresses):
+        raise UnsafeUrlError(url, "内部ネットワークのアドレスです")
+
+
+class RedirectResolver:
+    """
+    リダイレクト先のURLを一度だけ解決し、正規化した結果を覚えておく。
+
+    問い合わせには入力されたURLを使い、解決結果は正規化したURLごとに覚える。
+    """
+
+    def __init__(self, session, timeout=3.0, max_entries=4096):
+        self.session = session
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self._resolved = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, url):
+        canonical = canonicalize_url(url)
+        with self._lock:
+            if canonical in self._resolved:
+                self._resolved.move_to_end(canonical)
+                return self._resolved[canonical]
+
+        try:
+            response = self.session.head(url.strip(), allow_redirects=True, timeout=self.timeout)
+            resolved = canonicalize_url(response.url)
+        except Exception as e:
+            logger.info(f"リダイレクト先を解決できませんでした: {url} {e}")
+            # 一時的な失敗の可能性があるため覚えておかない
+            return canonical
+
+        with self._lock:
+            self._resolved[canonical] = resolved
+            while len(self._resolved) > self.max_entries:
+                self._resolved.popitem(last=False)
+        return resolved
+
+
+def _compile_pattern(pattern):
+    """NG URLのパターンを (ホスト, パスの前方一致) に変換する。"""
+    parts = urlsplit(pattern if "://" in pattern else f"https://{pattern}")
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = parts.path.rstrip("/")
+    return host, path
+
+
+class NgUrlMatcher:
+    """
+    NG URLの一覧をホスト名の後方一致・パスの前方一致で判定するマッチャー。
+
+    ホスト名をドメインの区切りごとに辞書で引くため、一覧の件数によらず判定は一定時間で終わる。
+    reload_interval 秒ごとに一覧(ng_url_list.py と extra_patterns)を読み込み直すため、
+    サーバーを再起動せずに一覧を更新できる。
+
+    :param extra_patterns: 追加のパターンのリストを返す関数（設定から読み込む場合など）
+    """
+
+    def __init__(self, module_name="ng_url_list", extra_patterns=None, reload_interval=30.0):
+        self.module_name = module_name
+        self.extra_patterns = extra_patterns
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._rules = {}
+        self._module_mtime = None
+        self._loaded_at = 0.0
+        self.reload()
+
+    def reload(self):
+        module = importlib.import_module(self.module_name)
+        path = getattr(module, "__file__", None)
+        mtime = os.path.getmtime(path) if path and os.path.exists(path) else None
+        if self._module_mtime is not None and mtime != self._module_mtime:
+            module = importlib.reload(module)
+
+        patterns = list(module.ng_urls)
+        if self.extra_patterns is not None:
+            try:
+                patterns += list(self.extra_patterns())
+            except Exception as e:
+                logger.warning(f"追加のNG URLを読み込めませんでした: {e}")
+
+        rules = {}
+        for pattern in patterns:
+            host, path_prefix = _compile_pattern(pattern)
+            if host:
+                rules.setdefault(host, []).append(path_prefix)
+        with self._lock:
+            if rules != self._rules:
+                logger.info(f"NG URLの一覧を読み込みました（{len(patterns)}件）")
+            self._rules = rules
+            self._module_mtime = mtime
+            self._loaded_at = time.monotonic()
+
+    def is_ng(self, url):
+        if time.monotonic() - self._loaded_at >= self.reload_interval:
+            self.reload()
+        try:
+            parts = urlsplit(canonicalize_url(url))
+            hostname = parts.hostname or ""
+        except ValueError:
+            # 解釈できないURLは取得もできないため、NGとはしない（従来の部分一致と同じく例外は出さない）
+            return False
+        labels = hostname.split(".")
+        path = parts.path
+        rules = self._rules
+        # sub.example.com -> example.com -> com の順にホストの後方一致を調べる
+        for i in range(len(labels)):
+            for path_prefix in rules.get(".".join(labels[i:]), ()):
+                if not path_prefix or path == path_prefix or path.startswith(path_prefix + "/"):
+                    return True
+        return False
@@ -0,0 +1,352 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PINECONE_DELETE_BATCH_SIZE = 1000
+
+
+class VectorStore:
+    """
+    ベクトルDBの共通インターフェース。
+
+    検索結果はPineconeと同じ形の辞書 {"matches": [{"id", "score", "metadata"}, ...]} で返す。
+    """
+
+    name = ""
+    # 同じインデックス名を使う別のテナント（APIキー）を区別するための値（APIキーのハッシュ）
+    tenant = ""
+
+    @property
+    def scope_name(self):
+        """ローカルのキャッシュやストアでこのインデックスを表すキー。テナントとインデックス名の組み合わせ。"""
+        return f"{self.tenant}/{self.name}" if self.tenant else self.name
+
+    def upsert(self, vectors, namespace):
+        """vectors: [{"id": str, "values": list[float], "metadata": dict}, ...]"""
+        raise NotImplementedError
+
+    def query(self, vector, top_k, namespace, include_metadata=True, filter=None):
+        raise NotImplementedError
+
+    def fetch(self, ids, namespace):
+        """保存済みのベクトルを {id: {"id", "values", "metadata"}} で返す。存在しないIDは含まれない。"""
+        raise NotImplementedError
+
+    def list_ids(self, prefix, namespace):
+        """IDが prefix で始まるベクトルのIDを返す。対応していないバックエンドでは NotImplementedError を送出する。"""
+        raise NotImplementedError
+
+    def delete(self, ids, namespace):
+        raise NotImplementedError
+
+    def delete_all(self, namespace):
+        raise NotImplementedError
+
+    def list_namespaces(self):
+        raise NotImplementedError
+
+    def namespace_vector_count(self, namespace):
+        raise NotImplementedError
+
+    def flush(self):
+        """書き込みをまとめて永続化するバックエンドで、未保存の変更を保存する。既定では何もしない。"""
+
+
+class PineconeVectorStore(VectorStore):
+    """PineconeのIndexをVectorStoreとして扱うラッパー。"""
+
+    def __init__(self, index, name="", tenant=""):
+        self.index = index
+        self.name = name
+        self.tenant = tenant
+
+    @staticmethod
+    def _to_dict(response):
+        return response.to_dict() if hasattr(response, "to_dict") else response
+
+    def upsert(self, vectors, namespace):
+        return self.index.upsert(vectors=vectors, namespace=namespace)
+
+    def query(self, vector, top_k, namespace, include_metadata=True, filter=None):
+        vector = vector.tolist() if hasattr(vector, "tolist") else list(vector)
+        kwargs = {"namespace": namespace, "vector": vector, "top_k": top_k, "include_metadata": include_metadata}
+        if filter:
+            kwargs["filter"] = filter
+        response = self._to_dict(self.index.query(**kwargs))
+        matches = [
+            {"id": match["id"], "score": match.get("score"), "metadata": match.get("metadata") or {}}
+            for match in response.get("matches", [])
+        ]
+        return {"matches": matches, "namespace": namespace}
+
+    def fetch(self, ids, namespace):
+        response = self._to_dict(self.index.fetch(ids=list(ids), namespace=namespace))
+        return {
+            vector_id: {"id": vector_id, "values": vector.get("values"), "metadata": vector.get("metadata") or {}}
+            for vector_id, vector in response.get("vectors", {}).items()
+        }
+
+    def list_ids(self, prefix, namespace):
+        # IDの一覧取得はサーバーレスインデックスかつ新しいクライアントでのみ利用できる
+        if not hasattr(self.index, "list"):
+            raise NotImplementedError("This Pinecone client does not support listing vector IDs")
+        ids = []
+        for page in self.index.list(prefix=prefix, namespace=namespace):
+            ids.extend(page)
+        return ids
+
+    def delete(self, ids, namespace):
+        ids = list(ids)
+        # Pineconeの1リクエストあたりの削除件数の上限に合わせて分割する
+        for start in range(0, len(ids), PINECONE_DELETE_BATCH_SIZE):
+            self.index.delete(ids=ids[start:start + PINECONE_DELETE_BATCH_SIZE], namespace=namespace)
+
+    def delete_all(self, namespace):
+        self.index.delete(delete_all=True, namespace=namespace)
+
+    def _namespace_stats(self):
+        return self._to_dict(self.index.describe_index_stats()).get("namespaces", {})
+
+    def list_namespaces(self):
+        return list(self._namespace_stats().keys())
+
+    def namespace_vector_count(self, namespace):
+        return self._namespace_stats().get(namespace, {}).get("vector_count", 0)
+
+
+def _matches_filter(metadata, filter):
+    """Pinecone形式のメタデータフィルタのうち $eq / $ne / $in / $nin と単純な一致をサポートする。"""
+    for key, condition in filter.items():
+        value = metadata.get(key)
+        values = value if isinstance(value, list) else [value]
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, expected in condition.items():
+            if op == "$eq" and expected not in values:
+                return False
+            if op == "$ne" and expected in values:
+                return False
+            if op == "$in" and not any(v in expected for v in values):
+                return False
+            if op == "$nin" and any(v in expected for v in values):
+                return False
+            if op not in ("$eq", "$ne", "$in", "$nin"):
+                raise ValueError(f"Unsupported filter operator: {op}")
+    return True
+
+
+class _NumpyNamespace:
+    def __init__(self):
+        self.ids = []
+        self.positions = {}
+        self.rows = []
+        self.metadata = []
+        self._matrix = None
+
+    def matrix(self):
+        # 書き込み後の最初の検索時にだけ正規化済みの行列を作り直す
+        if self._matrix is None:
+            if self.rows:
+                matrix = np.vstack(self.rows).astype(np.float32)
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                self._matrix = matrix / np.clip(norms, 1e-12, None)
+            else:
+                self._matrix = np.zeros((0, 0), dtype=np.float32)
+        return self._matrix
+
+    def upsert(self, vector_id, values, metadata):
+        row = np.asarray(values, dtype=np.float32)
+        if vector_id in self.positions:
+            position = self.positions[vector_id]
+            self.rows[position] = row
+            self.metadata[position] = metadata
+        else:
+            self.positions[vector_id] = len(self.ids)
+            self.ids.append(vector_id)
+            self.rows.append(row)
+            self.metadata.append(metadata)
+        self._matrix = None
+
+    def delete(self, ids):
+        ids = set(ids) & set(self.positions)
+        if not ids:
+            return
+        keep = [i for i, vector_id in enumerate(self.ids) if vector_id not in ids]
+        self.ids = [self.ids[i] for i in keep]
+        self.rows = [self.rows[i] for i in keep]
+        self.metadata = [self.metadata[i] for i in keep]
+        self.positions = {vector_id: i for i, vector_id in enumerate(self.ids)}
+        self._matrix = None
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    プロセス内のNumPy行列でコサイン類似度の厳密なtop-k検索を行うVectorStore。
+
+    小規模なテナントでの利用や、ネットワークなしでのテスト・ベンチマーク用。
+    path を指定すると起動時に読み込み、書き込みから persist_interval 秒後（または flush() の呼び出し時）に
+    まとめてディスクへ保存する。バッチごとにファイル全体を書き直さないため、登録の処理量はストアの大きさに比例しない。
+    """
+
+    def __init__(self, name="", path=None, persist_interval=5.0, tenant=""):
+        self.name = name
+        self.tenant = tenant
+        self.path = path
+        self.persist_interval = persist_interval
+        self._namespaces = {}
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._persist_timer = None
+        if path:
+            if os.path.exists(path):
+                self.load(path)
+            # プロセス終了時に未保存の変更を書き出す
+            atexit.register(self.flush)
+
+    def _namespace(self, namespace):
+        if namespace not in self._namespaces:
+            self._namespaces[namespace] = _NumpyNamespace()
+        return self._namespaces[namespace]
+
+    def upsert(self, vectors, namespace):
+        with self._lock:
+            ns = self._namespace(namespace)
+            for vector in vectors:
+                ns.upsert(vector["id"], vector["values"], dict(vector.get("metadata") or {}))
+            self._persist()
+        return {"upserted_count": len(vectors)}
+
+    def query(self, vector, top_k, namespace, include_metadata=True, filter=None):
+        with self._lock:
+            ns = self._namespaces.get(namespace)
+            if ns is None or not ns.ids:
+                return {"matches": [], "namespace": namespace}
+            matrix = ns.matrix()
+            ids = ns.ids
+            metadata = ns.metadata
+
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores = matrix @ query
+
+        candidates = np.arange(len(ids))
+        if filter:
+            candidates = np.array([i for i in candidates if _matches_filter(metadata[i], filter)], dtype=int)
+            if candidates.size == 0:
+                return {"matches": [], "namespace": namespace}
+            scores = scores[candidates]
+
+        k = min(top_k, scores.size)
+        if k < scores.size:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(scores.size)
+        top = top[np.argsort(-scores[top])]
+
+        matches = []
+        for i in top:
+            position = int(candidates[i])
+            matches.append({
+                "id": ids[position],
+                "score": float(scores[i]),
+                "metadata": dict(metadata[position]) if include_metadata else {},
+            })
+        return {"matches": matches, "namespace": namespace}
+
+    def fetch(self, ids, namespace):
+        with self._lock:
+            ns = self._namespaces.get(namespace)
+            if ns is None:
+                return {}
+            return {
+                vector_id: {
+                    "id": vector_id,
+                    "values": ns.rows[ns.positions[vector_id]].tolist(),
+                    "metadata": dict(ns.metadata[ns.positions[vector_id]]),
+                }
+                for vector_id in ids if vector_id in ns.positions
+            }
+
+    def list_ids(self, prefix, namespace):
+        with self._lock:
+            ns = self._namespaces.get(namespace)
+            return [vector_id for vector_id in ns.ids if vector_id.startswith(prefix)] if ns else []
+
+    def delete(self, ids, namespace):
+        with self._lock:
+            if namespace in self._namespaces:
+                self._namespaces[namespace].delete(ids)
+                self._persist()
+
+    def delete_all(self, namespace):
+        with self._lock:
+            self._namespaces.pop(namespace, None)
+            self._persist()
+
+    def list_namespaces(self):
+        with self._lock:
+            return [namespace for namespace, ns in self._namespaces.items() if ns.ids]
+
+    def namespace_vector_count(self, namespace):
+        with self._lock:
+            ns = self._namespaces.get(namespace)
+            return len(ns.ids) if ns else 0
+
+    def _persist(self):
+        # 呼び出し元はロックを保持している。保存は遅延させ、その間の書き込みは一度の保存にまとめる
+        if not self.path:
+            return
+        self._dirty = True
+        if self._persist_timer is None:
+            self._persist_timer = threading.Timer(self.persist_interval, self.flush)
+            self._persist_timer.daemon = True
+            self._persist_timer.start()
+
+    def flush(self):
+        with self._lock:
+            if self._persist_timer is not None:
+                self._persist_timer.cancel()
+                self._persist_timer = None
+            if not (self.path and self._dirty):
+                return
+            self.save(self.path)
+            self._dirty = False
+
+    def save(self, path):
+        """ネームスペースごとのベクトルをnpz、IDとメタデータをJSONとして一つのファイルに保存する。"""
+        with self._lock:
+            arrays = {}
+            index = {}
+            for i, (namespace, ns) in enumerate(self._namespaces.items()):
+                if not ns.ids:
+                    continue
+                arrays[f"ns_{i}"] = np.vstack(ns.rows).astype(np.float32)
+                index[f"ns_{i}"] = {"namespace": namespace, "ids": ns.ids, "metadata": ns.metadata}
+            arrays["index"] = np.frombuffer(json.dumps(index, ensure_ascii=False).encode("utf-8"), dtype=np.uint8)
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+
+    def load(self, path):
+        with self._lock, np.load(path) as data:
+            index = json.loads(data["index"].tobytes().decode("utf-8"))
+            self._namespaces = {}
+            for key, entry in index.items():
+                ns = self._namespace(entry["namespace"])
+                for vector_id, values, metadata in zip(entry["ids"], data[key], entry["metadata"]):
+                    ns.upsert(vector_id, values, metadata)
+
+
+def as_vector_store(index):
+    """PineconeのIndexが渡された場合はVectorStoreでラップして返す。"""
+    if isinstance(index, VectorStore):
+        return index
+    return PineconeVectorStore(index)